@@ -1,21 +1,63 @@
 #!/usr/bin/env python3
 
 # Standard library imports
+from collections import Counter
+from datetime import date
 
 # Remote library imports
 import os
-from flask import Flask, jsonify, request, make_response, session,render_template
+import click
+from flask import Flask, jsonify, request, make_response, session,render_template, Response, stream_with_context, abort
 
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_restful import Api, Resource
 import openai
+from sqlalchemy import func, select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
 load_dotenv()
 
 
 # Local imports
 from models import db, User, Product, ProductItem
+from passwords import hasher
+from pagination import paginated_response, keyset_query, fetch_page, set_next_page
+from filters import ListFilters, Sort
+from versioning import PatchSchema, expected_version, versioned_update, failed_update, row_version
+from cache import LRUCache
+from changes import record_changes, on_commit, conditional_get, user_scope
+from bulk import BulkSchema, validate_ids, missing_rows, duplicate_ids
+from quantities import item_deltas, apply_quantity_deltas, reconcile_quantities
+from expiry import BUCKETS, parse_window, bucket_for, bucket_case, window_end
+from search import MAX_RESULTS, search, stage_products, stage_items, stage_deleted
+from sync import CursorExpired, changes_since, compact, log_products, log_items
+from recipes import (
+    RecipeService, OpenAICompletionClient, StubCompletionClient, SQLiteRecipeStore,
+    normalize_ingredients, sse_stream
+)
+import query_budget
+import database
+import metrics
+import fastjson
+import compression
+from serializers import (
+    user_serializer, product_serializer, product_item_serializer, request_serializer
+)
+
+# Relationships expanded by default on detail responses; list endpoints are
+# flat unless ?include= or ?depth= asks for more
+USER_INCLUDE = 'products.product_items'
+PRODUCT_INCLUDE = 'user,product_items'
+PRODUCT_ITEM_INCLUDE = 'product.user'
+
+# Columns a single-row PATCH may change; the UPDATE bumps version itself
+user_patch_schema = PatchSchema(User, fields=('username', 'email', 'picture', 'password'))
+# A product's quantity is the sum of its items' (quantities.py), never written directly
+product_patch_schema = PatchSchema(
+    Product, fields=('name', 'user_id', 'category', 'storage_place', 'unit', 'low_limit')
+)
+product_item_patch_schema = PatchSchema(ProductItem, fields=('product_id', 'brand_name', 'quantity', 'expiry_date'))
 
 # Instantiate app, set attributes
 app = Flask(
@@ -26,19 +68,115 @@ app = Flask(
 )
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Optional read replica for GET requests; pool sizing, pre-ping and the
+# statement timeout come from the DB_* variables (see database.py)
+app.config['DATABASE_REPLICA_URI'] = os.environ.get('DATABASE_REPLICA_URI')
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+# bcrypt cost factor and the size of the hashing pool, per process. The cap
+# needs threaded workers; keep BCRYPT_WORKERS + BCRYPT_MAX_PENDING below
+# gunicorn's --threads (see passwords.py)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+app.config['BCRYPT_MAX_PENDING'] = int(os.environ.get('BCRYPT_MAX_PENDING', app.config['BCRYPT_WORKERS'] * 4))
+app.config['BCRYPT_QUEUE_TIMEOUT'] = float(os.environ.get('BCRYPT_QUEUE_TIMEOUT', 0.5))
+# Serialized /check_session users, keyed by user id
+app.config['SESSION_CACHE_SIZE'] = int(os.environ.get('SESSION_CACHE_SIZE', 1024))
+app.config['SESSION_CACHE_TTL'] = float(os.environ.get('SESSION_CACHE_TTL', 30))
+# Recipe answers are cached per normalized ingredient set. Set RECIPE_CACHE_PATH
+# to keep them in SQLite across restarts and RECIPE_CLIENT=stub to run offline
+app.config['RECIPE_CACHE_SIZE'] = int(os.environ.get('RECIPE_CACHE_SIZE', 512))
+app.config['RECIPE_CACHE_TTL'] = float(os.environ.get('RECIPE_CACHE_TTL', 24 * 60 * 60))
+app.config['RECIPE_CACHE_PATH'] = os.environ.get('RECIPE_CACHE_PATH')
+app.config['RECIPE_CLIENT'] = os.environ.get('RECIPE_CLIENT', 'openai')
+# Upstream limits for recipe calls; the ASGI entry point (asgi.py) keeps up to
+# RECIPE_MAX_CONCURRENCY of them in flight on one event loop
+app.config['RECIPE_MAX_CONCURRENCY'] = int(os.environ.get('RECIPE_MAX_CONCURRENCY', 200))
+app.config['RECIPE_TIMEOUT'] = float(os.environ.get('RECIPE_TIMEOUT', 30))
+# SQL statements allowed per request before it is reported as a likely N+1
+app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 0)) or None
+app.config['SQL_QUERY_BUDGET_MODE'] = os.environ.get('SQL_QUERY_BUDGET_MODE', 'warn')
+# JSON responses at or above this many bytes are gzip/brotli compressed when the client accepts it
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+# /sync cursors older than this many days need a full resync once the log is compacted
+app.config['CHANGE_LOG_RETENTION_DAYS'] = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 30))
 openai.api_key = os.getenv('OPENAI_API_KEY')
-app.json.compact = False
 
 migrate = Migrate(app, db)
+database.init_app(app, db)
 db.init_app(app)
+query_budget.init_app(app)
+metrics.init_app(app)
+hasher.init_app(app)
 
 # Instantiate REST API
 api = Api(app)
 
+# Compact JSON outside debug mode, encoded with orjson when it is installed
+fastjson.init_app(app, api)
+compression.init_app(app)
+
 # Initialize CORS with options
 CORS(app, supports_credentials=True)
 
+session_cache = LRUCache(
+    maxsize=app.config['SESSION_CACHE_SIZE'],
+    ttl=app.config['SESSION_CACHE_TTL']
+)
+
+recipe_service = RecipeService(
+    client=StubCompletionClient() if app.config['RECIPE_CLIENT'] == 'stub'
+    else OpenAICompletionClient(timeout=app.config['RECIPE_TIMEOUT']),
+    cache=LRUCache(maxsize=app.config['RECIPE_CACHE_SIZE'], ttl=app.config['RECIPE_CACHE_TTL']),
+    store=SQLiteRecipeStore(app.config['RECIPE_CACHE_PATH'], app.config['RECIPE_CACHE_TTL'])
+    if app.config['RECIPE_CACHE_PATH'] else None
+)
+
+
+def resolve_user_id():
+    # Scoped endpoints take ?user_id= and fall back to the logged-in user
+    user_id = request.args.get('user_id', type=int)
+    return user_id if user_id is not None else session.get('user_id')
+
+
+def product_owner(product_id):
+    return db.session.query(Product.user_id).filter_by(id=product_id).scalar()
+
+
+def product_owners(product_ids):
+    return db.session.scalars(
+        select(Product.user_id).where(Product.id.in_(set(product_ids))).distinct()
+    ).all()
+
+
+def patch_args(schema):
+    """Cleaned values and the expected version of a PATCH, aborting with 400 on bad input."""
+    data = request.get_json()
+    try:
+        return schema.clean(data), expected_version(data)
+    except ValueError as e:
+        abort(make_response(jsonify({'error': str(e)}), 400))
+
+
+def patched_response(serialize, model, obj):
+    """Commit a PATCH and answer with the updated row.
+
+    The row comes back from the UPDATE, so only ?include= costs a query.
+    """
+    data = serialize(obj) if len(serialize.tables) == 1 else None
+    db.session.commit()
+    if data is None:
+        data = serialize(serialize.query(model).filter_by(id=obj.id).first())
+    return make_response(jsonify(data), 200)
+
+
+@on_commit
+def invalidate_sessions(user_ids):
+    for user_id in user_ids:
+        session_cache.invalidate(user_id)
+
 # Define home route
 @app.route('/')
 def home():
@@ -91,25 +229,39 @@ def home():
             <h1>Welcome to Pantry Pal API</h1>
             <p>This is the API for Pantry Pal application.</p>
             <p>Endpoints:</p>
+            <p>List endpoints accept <strong>?limit=</strong> and <strong>?after=</strong> for keyset pagination (next cursor in the <strong>X-Next-Cursor</strong> header) and <strong>?format=ndjson</strong> to stream rows. Lists are flat; use <strong>?include=</strong> (e.g. products.product_items) or <strong>?depth=</strong> to expand relationships.</p>
+            <p>List and detail endpoints accept <strong>?fields=</strong> to return only some columns (e.g. name,quantity,product_items.brand_name); id is always returned and only the picked columns are selected.</p>
+            <p>GET responses carry an <strong>ETag</strong>; send it back in <strong>If-None-Match</strong> to get <strong>304 Not Modified</strong> when nothing changed.</p>
+            <p>Rows carry a <strong>version</strong>. PATCH with <strong>If-Match: "&lt;version&gt;"</strong> (412 if the row changed since) or a <strong>version</strong> in the body (409) to avoid overwriting someone else's edit.</p>
             <ul>
                 <li><strong>/users</strong> -:GET - List of all users details</li>
                 <li><strong>/users</strong> -:POST - Sign up a new user</li>
                 <li><strong>/users/int:id</strong> -:GET - Get a user details</li>
                 <li><strong>/users/int:id</strong> -:PATCH - Update a user details</li>
                 <li><strong>/users/int:id</strong> -:DELETE - Delete a user</li>
+                <li><strong>/users/int:id/products</strong> -:GET - List a user's products</li>
+                <li><strong>/users/int:id/product_items</strong> -:GET - List a user's product items</li>
                 <li><strong>/login</strong> -:POST - User login</li>
                 <li><strong>/logout</strong> -:DELETE - User logout</li>
                 <li><strong>/check_session</strong>:GET - Check user session</li>
-                <li><strong>/products</strong>:GET - List of all products</li>
+                <li><strong>/metrics</strong>:GET - Prometheus metrics: request latency, in-flight requests, SQL, bcrypt and recipe API timings</li>
+                <li><strong>/cache_stats</strong>:GET - Session and recipe cache hit/miss counters</li>
+                <li><strong>/products</strong>:GET - List of all products; filter with ?user_id=, ?category=, ?storage_place= (comma-separate several values) and order with ?sort=name|quantity (prefix - for descending)</li>
                 <li><strong>/products</strong>:POST - Create a new product</li>
                 <li><strong>/products/int:id</strong>:GET - Get a specific product</li>
-                <li><strong>/products/int:id</strong>:PATCH - Update a specific product</li>
+                <li><strong>/products/int:id</strong>:PATCH - Update a specific product (quantity is the sum of its items and cannot be set)</li>
                 <li><strong>/products/int:id</strong>:DELETE - Delete a specific product</li>
-                <li><strong>/product_items</strong>:GET - List of all product items</li>
+                <li><strong>/products/low_stock?user_id=</strong>:GET - A user's products at or below their low limit</li>
+                <li><strong>/products/bulk</strong>:POST/PATCH/DELETE - Create, update or delete many products in one transaction</li>
+                <li><strong>/product_items</strong>:GET - List of all product items; filter with ?product_id=, ?brand_name= and order with ?sort=expiry_date|quantity|brand_name</li>
                 <li><strong>/product_items</strong>:POST - Create a new product item</li>
                 <li><strong>/product_items/int:id</strong>:GET - Get a specific product item</li>
                 <li><strong>/product_items/int:id</strong>:PATCH - Update a specific product item</li>
                 <li><strong>/product_items/int:id</strong>:DELETE - Delete a specific product item</li>
+                <li><strong>/product_items/expiring?within=7d&amp;user_id=</strong>:GET - A user's items expiring soon, grouped into expired/today/this_week/this_month/later; pages with ?limit= and ?after= like the lists</li>
+                <li><strong>/product_items/bulk</strong>:POST/PATCH/DELETE - Create, update or delete many product items in one transaction</li>
+                <li><strong>/search?q=&amp;user_id=</strong>:GET - Ranked prefix and fuzzy search over a user's product names, categories and brand names</li>
+                <li><strong>/sync?user_id=&amp;since=</strong>:GET - A user's products and items changed since a cursor, with tombstones for deletions (a deleted product's items are gone too); omit since for everything. 410 means the cursor expired and a full sync is needed</li>
             </ul>
         </div>
     </body>
@@ -118,8 +270,11 @@ def home():
 
 class Users(Resource):
     def get(self):
-        users = [user.to_dict() for user in User.query.all()]
-        return make_response(jsonify(users), 200)
+        serialize = request_serializer(user_serializer)
+        return conditional_get(
+            serialize.tables,
+            lambda: paginated_response(serialize.query(User), User, serialize)
+        )
 
     def post(self):
         data = request.get_json()
@@ -143,9 +298,13 @@ class Users(Resource):
 
         # Add the new user to the database
         db.session.add(new_user)
+        db.session.flush()
+        record_changes([new_user.id])
         db.session.commit()
 
-        return make_response(jsonify(new_user.to_dict()), 201)
+        serialize = request_serializer(user_serializer, USER_INCLUDE)
+        new_user = serialize.query(User).filter_by(id=new_user.id).first()
+        return make_response(jsonify(serialize(new_user)), 201)
 
 api.add_resource(Users, '/users')
 
@@ -153,24 +312,46 @@ api.add_resource(Users, '/users')
 
 class UserByID(Resource):
     def get(self, id):
-        user = User.query.filter_by(id=id).first().to_dict()
-        return make_response(jsonify(user), 200)
+        serialize = request_serializer(user_serializer, USER_INCLUDE)
 
-    def patch(self, id):
-        user = User.query.filter_by(id=id).first()
-        data = request.get_json()
+        # Every write to the user's products and items bumps user:<id>
+        def build():
+            user = serialize.query(User).filter_by(id=id).first()
+            if user is None:
+                return make_response(jsonify({'error': 'User not found'}), 404)
+            return make_response(jsonify(serialize(user)), 200)
 
-        for key, value in data.items():
-            setattr(user, key, value)
+        # The ETag leads with the row version, for If-Match on a PATCH
+        version = row_version(User, id)
+        if version is None:
+            return make_response(jsonify({'error': 'User not found'}), 404)
+        return conditional_get([user_scope(id)], build, version)
 
-        db.session.commit()
+    def patch(self, id):
+        serialize = request_serializer(user_serializer)
+        values, (expected, status) = patch_args(user_patch_schema)
+        if 'password' in values:
+            password = values.pop('password')
+            if not isinstance(password, str) or not password:
+                return make_response(jsonify({'error': 'password must be a non-empty string'}), 400)
+            values['_password_hash'] = hasher.hash(password)
 
-        return make_response(jsonify(user.to_dict()), 200)
+        try:
+            user = versioned_update(User, id, values, expected)
+        except IntegrityError as e:
+            return conflict(e)
+        if user is None:
+            return failed_update(User, id, status)
 
-    def delete(self, id):
-        user = User.query.filter_by(id=id).first()
+        record_changes([id])
+        return patched_response(serialize, User, user)
 
-        db.session.delete(user)
+    def delete(self, id):
+        # Products and items go with it through ON DELETE CASCADE, unloaded
+        if db.session.execute(delete(User).where(User.id == id).returning(User.id)).first() is None:
+            return make_response(jsonify({'error': 'User not found'}), 404)
+        stage_deleted(User, [id])
+        record_changes([id])
         db.session.commit()
 
         return '', 204
@@ -178,6 +359,25 @@ class UserByID(Resource):
 
 api.add_resource(UserByID, '/users/<int:id>')
 
+
+# Per-user listings, each a single query on an indexed foreign key
+class UserProducts(Resource):
+    def get(self, id):
+        serialize = request_serializer(product_serializer)
+        query = serialize.query(Product).filter(Product.user_id == id)
+        return conditional_get([user_scope(id)], lambda: paginated_response(query, Product, serialize))
+
+api.add_resource(UserProducts, '/users/<int:id>/products')
+
+
+class UserProductItems(Resource):
+    def get(self, id):
+        serialize = request_serializer(product_item_serializer)
+        query = serialize.query(ProductItem).join(ProductItem.product).filter(Product.user_id == id)
+        return conditional_get([user_scope(id)], lambda: paginated_response(query, ProductItem, serialize))
+
+api.add_resource(UserProductItems, '/users/<int:id>/product_items')
+
 class Login(Resource):
     def post(self):
         data = request.get_json()
@@ -190,14 +390,24 @@ class Login(Resource):
         if not password:
             return {'message': 'Password is required'}, 400
         
-        user = User.query.filter_by(email=email).first()
+        serialize = user_serializer.compile(USER_INCLUDE)
+        user = serialize.query(User).filter_by(email=email).first()
         
         if not user:
             return {'error': 'Email not found'}, 404
         
         if user.check_password(password):
-            session['user_id'] = user.id
-            return user.to_dict(), 200
+            # Read before the commit below expires the user; touching it
+            # afterwards would reload it and every included relationship
+            user_id, user_data = user.id, serialize(user)
+            # Upgrade hashes made with a different cost factor while we have the plaintext
+            if user.password_needs_rehash():
+                user.password = password
+                db.session.commit()
+
+            session['user_id'] = user_id
+            session_cache.set(user_id, user_data)
+            return user_data, 200
         
         return {'error': 'Invalid password'}, 401
 
@@ -212,9 +422,16 @@ class CheckSession(Resource):
     def get(self):
         if 'user_id' in session:
             user_id = session['user_id']
-            user = User.query.get(user_id)
+            user_data = session_cache.get(user_id)
+            if user_data is not None:
+                return user_data, 200
+
+            serialize = user_serializer.compile(USER_INCLUDE)
+            user = serialize.query(User).filter_by(id=user_id).first()
             if user:
-                return user.to_dict(), 200  # Return a dictionary instead of a Response object
+                user_data = serialize(user)
+                session_cache.set(user_id, user_data)
+                return user_data, 200  # Return a dictionary instead of a Response object
             else:
                 return {'message': 'User not found'}, 404
         else:
@@ -227,27 +444,66 @@ api.add_resource(Logout, '/logout')
 api.add_resource(CheckSession, '/check_session')
 
 
+class CacheStats(Resource):
+    def get(self):
+        return {
+            'session': session_cache.stats(),
+            'recipes': recipe_service.stats(),
+        }, 200
+
+api.add_resource(CacheStats, '/cache_stats')
+
+
+def list_args(filters):
+    """Parse a list endpoint's filters and sort, aborting with 400 on bad input."""
+    try:
+        return filters.parse(request.args)
+    except ValueError as e:
+        abort(make_response(jsonify({'error': str(e)}), 400))
+
+
+# ?user_id=&category= and ?user_id=&storage_place= are range scans on the
+# (user_id, category) and (user_id, storage_place) indexes
+product_filters = ListFilters(
+    Product,
+    filters=('user_id', 'category', 'storage_place'),
+    sorts=('name', 'quantity')
+)
+
+
 # Product Resources
 class Products(Resource):
     def get(self):
-        products = [product.to_dict() for product in Product.query.all()]
-        return make_response(jsonify(products), 200)
+        conditions, sort = list_args(product_filters)
+        # The cursor of a sorted page is read from the sort column
+        serialize = request_serializer(product_serializer, required_fields=[sort.column.key] if sort else ())
+        return conditional_get(
+            serialize.tables,
+            lambda: paginated_response(serialize.query(Product).filter(*conditions), Product, serialize, sort)
+        )
 
     def post(self):
         data = request.get_json()
+        # quantity is the sum of the product's items, like in /products/bulk
+        if isinstance(data, dict) and 'quantity' in data:
+            return make_response(jsonify({'error': 'Unknown fields: quantity'}), 400)
         try:
             new_product = Product(
                 name=data['name'],
                 user_id=data['user_id'],
                 category=data['category'],
                 storage_place=data['storage_place'],
-                quantity=data.get('quantity', 0),
+                # New products have no items yet
+                quantity=0,
                 unit=data['unit'],
                 low_limit=data.get('low_limit', 0)
             )
             db.session.add(new_product)
+            record_changes([data['user_id']])
             db.session.commit()
-            return make_response(jsonify(new_product.to_dict()), 201)
+            serialize = request_serializer(product_serializer, PRODUCT_INCLUDE)
+            new_product = serialize.query(Product).filter_by(id=new_product.id).first()
+            return make_response(jsonify(serialize(new_product)), 201)
         except Exception as e:
             db.session.rollback()
             return make_response(jsonify({'error': str(e)}), 500)
@@ -258,24 +514,49 @@ api.add_resource(Products, '/products')
 
 class ProductByID(Resource):
     def get(self, id):
-        product = Product.query.filter_by(id=id).first().to_dict()
-        return make_response(jsonify(product), 200)
+        serialize = request_serializer(product_serializer, PRODUCT_INCLUDE)
 
-    def patch(self, id):
-        product = Product.query.filter_by(id=id).first()
-        data = request.get_json()
+        def build():
+            product = serialize.query(Product).filter_by(id=id).first()
+            if product is None:
+                return make_response(jsonify({'error': 'Product not found'}), 404)
+            return make_response(jsonify(serialize(product)), 200)
 
-        for key, value in data.items():
-            setattr(product, key, value)
+        version = row_version(Product, id)
+        if version is None:
+            return make_response(jsonify({'error': 'Product not found'}), 404)
+        return conditional_get(serialize.tables, build, version)
 
-        db.session.commit()
+    def patch(self, id):
+        serialize = request_serializer(product_serializer)
+        values, (expected, status) = patch_args(product_patch_schema)
 
-        return make_response(jsonify(product.to_dict()), 200)
+        old_user_id = None
+        if 'user_id' in values:
+            # A move changes two users' data; lock the row while reading its owner
+            old_user_id = db.session.scalar(select(Product.user_id).where(Product.id == id).with_for_update())
 
-    def delete(self, id):
-        product = Product.query.filter_by(id=id).first()
+        try:
+            product = versioned_update(Product, id, values, expected)
+        except IntegrityError as e:
+            return conflict(e)
+        if product is None:
+            return failed_update(Product, id, status)
+
+        owners = {old_user_id or product.user_id, product.user_id}
+        stage_products([product])
+        log_products((id, user_id) for user_id in owners)
+        record_changes(owners)
+        return patched_response(serialize, Product, product)
 
-        db.session.delete(product)
+    def delete(self, id):
+        # Items go with it through ON DELETE CASCADE, unloaded
+        user_id = db.session.scalar(delete(Product).where(Product.id == id).returning(Product.user_id))
+        if user_id is None:
+            return make_response(jsonify({'error': 'Product not found'}), 404)
+        stage_deleted(Product, [id])
+        log_products([(id, user_id)])
+        record_changes([user_id])
         db.session.commit()
 
         return '', 204
@@ -283,11 +564,149 @@ class ProductByID(Resource):
 api.add_resource(ProductByID, '/products/<int:id>')
 
 
+product_schema = BulkSchema(
+    Product,
+    required=('name', 'user_id', 'category', 'storage_place', 'unit'),
+    defaults={'quantity': 0, 'low_limit': 0},
+    read_only=('quantity',)
+)
+
+
+def bulk_errors(errors):
+    return make_response(jsonify({'errors': errors}), 400)
+
+
+def conflict(e):
+    db.session.rollback()
+    return make_response(jsonify({'error': str(e.orig)}), 409)
+
+
+# Bulk writes: the whole array is validated first, then written in one
+# transaction with executemany-style statements. Results are per row, in
+# request order (sort_by_parameter_order keeps RETURNING rows matched to
+# the rows sent when the INSERT is batched).
+class ProductsBulk(Resource):
+    def post(self):
+        rows, errors = product_schema.validate(request.get_json())
+        errors = errors or missing_rows(User, [(i, row['user_id']) for i, row in enumerate(rows)], 'User')
+        if errors:
+            return bulk_errors(errors)
+
+        serialize = product_serializer.compile()
+        try:
+            products = db.session.scalars(insert(Product).returning(Product, sort_by_parameter_order=True), rows).all()
+            results = [
+                {'index': index, 'status': 201, 'data': serialize(product)}
+                for index, product in enumerate(products)
+            ]
+            stage_products(products)
+            log_products((product.id, product.user_id) for product in products)
+            record_changes([row['user_id'] for row in rows])
+            db.session.commit()
+        except IntegrityError as e:
+            return conflict(e)
+
+        return make_response(jsonify(results), 201)
+
+    def patch(self):
+        rows, errors = product_schema.validate(request.get_json(), partial=True)
+        ids = [row['id'] for row in rows]
+        errors = (
+            errors
+            or duplicate_ids(ids)
+            or missing_rows(Product, list(enumerate(ids)), 'Product')
+            or missing_rows(User, [(i, row['user_id']) for i, row in enumerate(rows) if 'user_id' in row], 'User')
+        )
+        if errors:
+            return bulk_errors(errors)
+
+        old_owners = db.session.execute(select(Product.id, Product.user_id).where(Product.id.in_(ids))).tuples().all()
+        try:
+            # Bulk UPDATE by primary key, batched per set of columns
+            db.session.execute(update(Product).values(version=Product.version + 1), rows)
+            serialize = product_serializer.compile()
+            products = {product.id: product for product in Product.query.filter(Product.id.in_(ids))}
+            results = [
+                {'index': index, 'status': 200, 'data': serialize(products[id])}
+                for index, id in enumerate(ids)
+            ]
+            stage_products(products.values())
+            log_products(old_owners)
+            log_products((product.id, product.user_id) for product in products.values())
+            record_changes(
+                [user_id for _, user_id in old_owners] + [row['user_id'] for row in rows if 'user_id' in row]
+            )
+            db.session.commit()
+        except IntegrityError as e:
+            return conflict(e)
+
+        return make_response(jsonify(results), 200)
+
+    def delete(self):
+        ids = request.get_json()
+        errors = validate_ids(ids) or duplicate_ids(ids) or missing_rows(Product, list(enumerate(ids)), 'Product')
+        if errors:
+            return bulk_errors(errors)
+
+        # Items go with them through ON DELETE CASCADE
+        owners = db.session.execute(
+            delete(Product).where(Product.id.in_(ids)).returning(Product.id, Product.user_id)
+        ).tuples().all()
+        stage_deleted(Product, ids)
+        log_products(owners)
+        record_changes([user_id for _, user_id in owners])
+        db.session.commit()
+
+        results = [{'index': index, 'status': 204, 'id': id} for index, id in enumerate(ids)]
+        return make_response(jsonify(results), 200)
+
+api.add_resource(ProductsBulk, '/products/bulk')
+
+
+# Only what the shopping-list widget shows
+LOW_STOCK_COLUMNS = (
+    Product.id, Product.name, Product.category, Product.quantity, Product.low_limit, Product.unit
+)
+
+
+class LowStockProducts(Resource):
+    def get(self):
+        user_id = resolve_user_id()
+        if user_id is None:
+            return make_response(jsonify({'error': 'user_id is required'}), 400)
+
+        # Matches the ix_products_low_stock partial index predicate
+        query = (
+            select(*LOW_STOCK_COLUMNS)
+            .where(Product.user_id == user_id, Product.quantity <= Product.low_limit)
+            .order_by(Product.name)
+        )
+
+        def build():
+            return make_response(jsonify([dict(row) for row in db.session.execute(query).mappings()]), 200)
+
+        return conditional_get([user_scope(user_id)], build)
+
+api.add_resource(LowStockProducts, '/products/low_stock')
+
+
+# ?product_id= uses the (product_id, expiry_date) index
+product_item_filters = ListFilters(
+    ProductItem,
+    filters=('product_id', 'brand_name'),
+    sorts=('expiry_date', 'quantity', 'brand_name')
+)
+
+
 # ProductItem Resources
 class ProductItems(Resource):
     def get(self):
-        product_items = [item.to_dict() for item in ProductItem.query.all()]
-        return make_response(jsonify(product_items), 200)
+        conditions, sort = list_args(product_item_filters)
+        serialize = request_serializer(product_item_serializer, required_fields=[sort.column.key] if sort else ())
+        return conditional_get(
+            serialize.tables,
+            lambda: paginated_response(serialize.query(ProductItem).filter(*conditions), ProductItem, serialize, sort)
+        )
 
     def post(self):
         data = request.get_json()
@@ -302,54 +721,320 @@ class ProductItems(Resource):
 
         # Add the new product item to the database
         db.session.add(new_product_item)
+        apply_quantity_deltas(item_deltas(new=(data['product_id'], data['quantity'])))
+        # Items also change their product's quantity total
+        record_changes([product_owner(data['product_id'])])
         db.session.commit()
 
-        return make_response(jsonify(new_product_item.to_dict()), 201)
+        serialize = request_serializer(product_item_serializer, PRODUCT_ITEM_INCLUDE)
+        new_product_item = serialize.query(ProductItem).filter_by(id=new_product_item.id).first()
+        return make_response(jsonify(serialize(new_product_item)), 201)
 
 api.add_resource(ProductItems, '/product_items')
 
 class ProductItemByID(Resource):
     def get(self, id):
-        product_item = ProductItem.query.filter_by(id=id).first().to_dict()
-        return make_response(jsonify(product_item), 200)
+        serialize = request_serializer(product_item_serializer, PRODUCT_ITEM_INCLUDE)
 
-    def patch(self, id):
-        product_item = ProductItem.query.filter_by(id=id).first()
-        data = request.get_json()
+        def build():
+            product_item = serialize.query(ProductItem).filter_by(id=id).first()
+            if product_item is None:
+                return make_response(jsonify({'error': 'ProductItem not found'}), 404)
+            return make_response(jsonify(serialize(product_item)), 200)
 
-        for key, value in data.items():
-            setattr(product_item, key, value)
+        version = row_version(ProductItem, id)
+        if version is None:
+            return make_response(jsonify({'error': 'ProductItem not found'}), 404)
+        return conditional_get(serialize.tables, build, version)
 
-        db.session.commit()
+    def patch(self, id):
+        serialize = request_serializer(product_item_serializer)
+        values, (expected, status) = patch_args(product_item_patch_schema)
+
+        old = None
+        if 'product_id' in values or 'quantity' in values:
+            # Lock the row so the quantity delta is taken from what we overwrite
+            old = db.session.execute(
+                select(ProductItem.product_id, ProductItem.quantity)
+                .where(ProductItem.id == id)
+                .with_for_update()
+            ).first()
 
-        return make_response(jsonify(product_item.to_dict()), 200)
+        try:
+            product_item = versioned_update(ProductItem, id, values, expected)
+        except IntegrityError as e:
+            return conflict(e)
+        if product_item is None:
+            return failed_update(ProductItem, id, status)
+
+        product_ids = {product_item.product_id}
+        if old is not None:
+            apply_quantity_deltas(item_deltas(
+                old=tuple(old), new=(product_item.product_id, product_item.quantity)
+            ))
+            product_ids.add(old.product_id)
+        stage_items([product_item])
+        log_items((id, product_id) for product_id in product_ids)
+        record_changes(product_owners(product_ids))
+        return patched_response(serialize, ProductItem, product_item)
 
     def delete(self, id):
-        product_item = ProductItem.query.filter_by(id=id).first()
-
-        db.session.delete(product_item)
+        deleted = db.session.execute(
+            delete(ProductItem).where(ProductItem.id == id).returning(ProductItem.product_id, ProductItem.quantity)
+        ).first()
+        if deleted is None:
+            return make_response(jsonify({'error': 'ProductItem not found'}), 404)
+        product_id, quantity = deleted
+        apply_quantity_deltas(item_deltas(old=(product_id, quantity)))
+        stage_deleted(ProductItem, [id])
+        log_items([(id, product_id)])
+        record_changes([product_owner(product_id)])
         db.session.commit()
 
         return '', 204
 
 api.add_resource(ProductItemByID, '/product_items/<int:id>')
 
+
+product_item_schema = BulkSchema(
+    ProductItem,
+    required=('product_id', 'brand_name', 'quantity')
+)
+
+
+class ProductItemsBulk(Resource):
+    def post(self):
+        rows, errors = product_item_schema.validate(request.get_json())
+        product_ids = [row['product_id'] for row in rows]
+        errors = errors or missing_rows(Product, list(enumerate(product_ids)), 'Product')
+        if errors:
+            return bulk_errors(errors)
+
+        deltas = Counter()
+        for row in rows:
+            deltas.update(item_deltas(new=(row['product_id'], row['quantity'])))
+        serialize = product_item_serializer.compile()
+        try:
+            items = db.session.scalars(insert(ProductItem).returning(ProductItem, sort_by_parameter_order=True), rows).all()
+            apply_quantity_deltas(deltas)
+            results = [
+                {'index': index, 'status': 201, 'data': serialize(item)}
+                for index, item in enumerate(items)
+            ]
+            stage_items(items)
+            log_items((item.id, item.product_id) for item in items)
+            record_changes(product_owners(product_ids))
+            db.session.commit()
+        except IntegrityError as e:
+            return conflict(e)
+
+        return make_response(jsonify(results), 201)
+
+    def patch(self):
+        rows, errors = product_item_schema.validate(request.get_json(), partial=True)
+        ids = [row['id'] for row in rows]
+        errors = (
+            errors
+            or duplicate_ids(ids)
+            or missing_rows(ProductItem, list(enumerate(ids)), 'ProductItem')
+            or missing_rows(Product, [(i, row['product_id']) for i, row in enumerate(rows) if 'product_id' in row], 'Product')
+        )
+        if errors:
+            return bulk_errors(errors)
+
+        # Lock the rows, in id order, so the deltas are taken from what we overwrite
+        old = {
+            id: (product_id, quantity) for id, product_id, quantity in db.session.execute(
+                select(ProductItem.id, ProductItem.product_id, ProductItem.quantity)
+                .where(ProductItem.id.in_(ids))
+                .order_by(ProductItem.id)
+                .with_for_update()
+            )
+        }
+        deltas = Counter()
+        for row in rows:
+            old_product_id, old_quantity = old[row['id']]
+            deltas.update(item_deltas(
+                old=(old_product_id, old_quantity),
+                new=(row.get('product_id', old_product_id), row.get('quantity', old_quantity))
+            ))
+        product_ids = list(deltas) + [product_id for product_id, _ in old.values()]
+        try:
+            db.session.execute(update(ProductItem).values(version=ProductItem.version + 1), rows)
+            apply_quantity_deltas(deltas)
+            serialize = product_item_serializer.compile()
+            items = {item.id: item for item in ProductItem.query.filter(ProductItem.id.in_(ids))}
+            results = [
+                {'index': index, 'status': 200, 'data': serialize(items[id])}
+                for index, id in enumerate(ids)
+            ]
+            stage_items(items.values())
+            log_items((id, product_id) for id, (product_id, _) in old.items())
+            log_items((item.id, item.product_id) for item in items.values())
+            record_changes(product_owners(product_ids))
+            db.session.commit()
+        except IntegrityError as e:
+            return conflict(e)
+
+        return make_response(jsonify(results), 200)
+
+    def delete(self):
+        ids = request.get_json()
+        errors = validate_ids(ids) or duplicate_ids(ids) or missing_rows(ProductItem, list(enumerate(ids)), 'ProductItem')
+        if errors:
+            return bulk_errors(errors)
+
+        # The deltas come from the rows as deleted, not from an earlier read
+        old = db.session.execute(
+            delete(ProductItem).where(ProductItem.id.in_(ids))
+            .returning(ProductItem.id, ProductItem.product_id, ProductItem.quantity)
+        ).all()
+        deltas = Counter()
+        for _, product_id, quantity in old:
+            deltas.update(item_deltas(old=(product_id, quantity)))
+        product_ids = [product_id for _, product_id, _ in old]
+        stage_deleted(ProductItem, ids)
+        log_items((id, product_id) for id, product_id, _ in old)
+        apply_quantity_deltas(deltas)
+        record_changes(product_owners(product_ids))
+        db.session.commit()
+
+        results = [{'index': index, 'status': 204, 'id': id} for index, id in enumerate(ids)]
+        return make_response(jsonify(results), 200)
+
+api.add_resource(ProductItemsBulk, '/product_items/bulk')
+
+
+class ExpiringProductItems(Resource):
+    def get(self):
+        user_id = resolve_user_id()
+        if user_id is None:
+            return make_response(jsonify({'error': 'user_id is required'}), 400)
+
+        try:
+            days = parse_window(request.args.get('within', '7d'))
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        serialize = request_serializer(product_item_serializer, 'product', required_fields=('expiry_date',))
+        today = date.today()
+
+        conditions = [Product.user_id == user_id, ProductItem.expiry_date <= window_end(today, days)]
+        if request.args.get('include_expired', 'true').lower() == 'false':
+            conditions.append(ProductItem.expiry_date >= today)
+
+        # Range scan on (product_id, expiry_date) for each of the user's products,
+        # paged on (expiry_date, id) like a sorted /product_items
+        sort = Sort(ProductItem.expiry_date, descending=False)
+        try:
+            query, limit = keyset_query(
+                serialize.query(ProductItem).join(ProductItem.product).filter(*conditions), ProductItem, sort
+            )
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        def build():
+            items, cursor = fetch_page(query, limit, sort)
+            buckets = {name: [] for name in BUCKETS}
+            for item in items:
+                buckets[bucket_for(item.expiry_date, today)].append(serialize(item))
+
+            # Counts cover the whole window, not just this page
+            if limit is None:
+                counts = {name: len(entries) for name, entries in buckets.items()}
+            else:
+                bucket = bucket_case(ProductItem.expiry_date, today)
+                counts = dict.fromkeys(BUCKETS, 0)
+                counts.update(db.session.execute(
+                    select(bucket, func.count())
+                    .select_from(ProductItem).join(ProductItem.product)
+                    .where(*conditions)
+                    .group_by(bucket)
+                ).all())
+
+            return set_next_page(make_response(jsonify({
+                'as_of': today.isoformat(),
+                'within_days': days,
+                'counts': counts,
+                'buckets': buckets,
+            }), 200), limit, cursor)
+
+        # The buckets move with the date as well as with the user's writes
+        return conditional_get([user_scope(user_id)], build, depends_on=[today])
+
+api.add_resource(ExpiringProductItems, '/product_items/expiring')
+
+
+class Search(Resource):
+    def get(self):
+        user_id = resolve_user_id()
+        if user_id is None:
+            return make_response(jsonify({'error': 'user_id is required'}), 400)
+
+        query = request.args.get('q', '').strip()
+        if not query:
+            return make_response(jsonify({'error': 'q is required'}), 400)
+
+        limit = request.args.get('limit', '20')
+        if not limit.isdigit() or int(limit) < 1:
+            return make_response(jsonify({'error': 'limit must be a positive integer'}), 400)
+        limit = min(int(limit), MAX_RESULTS)
+
+        # Prefix and fuzzy matches on product names, categories and item brand names
+        def build():
+            return make_response(jsonify({'query': query, 'results': search(user_id, query, limit)}), 200)
+
+        return conditional_get([user_scope(user_id)], build)
+
+api.add_resource(Search, '/search')
+
+
+class Sync(Resource):
+    def get(self):
+        user_id = resolve_user_id()
+        if user_id is None:
+            return make_response(jsonify({'error': 'user_id is required'}), 400)
+
+        since = request.args.get('since')
+        if since is not None and not since.isdigit():
+            return make_response(jsonify({'error': 'since must be a cursor from a previous /sync response'}), 400)
+
+        # Only rows logged after the cursor are read, so resumes cost what changed
+        def build():
+            try:
+                changes = changes_since(user_id, int(since) if since is not None else None)
+            except CursorExpired as e:
+                return make_response(jsonify({'error': str(e)}), 410)
+            except ValueError as e:
+                return make_response(jsonify({'error': str(e)}), 400)
+            return make_response(jsonify(changes), 200)
+
+        return conditional_get([user_scope(user_id)], build)
+
+api.add_resource(Sync, '/sync')
+
 class Recipes(Resource):
     def post(self):
         data = request.get_json()
-        ingredients = data.get('ingredients', '')
-        
+        try:
+            ingredients = normalize_ingredients(data.get('ingredients', '') if isinstance(data, dict) else '')
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
         if not ingredients:
             return {'error': 'Ingredients are required'}, 400
+
+        # Stream tokens as they arrive, ending with the same array as the JSON response
+        if request.accept_mimetypes.best == 'text/event-stream':
+            events = sse_stream(recipe_service.stream_recipes(ingredients))
+            return Response(
+                stream_with_context(events),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
         try:
-            response = openai.Completion.create(
-                model="gpt-4o-mini",
-                prompt=f"Based on the following ingredients: {ingredients}, provide two recipe ideas with a brief description.",
-                max_tokens=150
-            )
-            recipes_text = response.choices[0].text.strip()
-            recipes_array = recipes_text.split('\n')
+            recipes_array = recipe_service.get_recipes(ingredients)
             return make_response(jsonify(recipes_array), 200)
         except Exception as e:
             return make_response(jsonify({'error': str(e)}), 500)
@@ -357,5 +1042,29 @@ class Recipes(Resource):
 # Add the Recipes resource to the API
 api.add_resource(Recipes, '/recipes')
 
+
+@app.cli.command('reconcile-quantities')
+def reconcile_quantities_command():
+    """Reset Product.quantity to the sum of its items wherever it drifted."""
+    drift = reconcile_quantities()
+    product_ids = [product_id for product_id, _, _ in drift]
+    # Clients see the new totals through ETags and /sync like any other write
+    log_products(db.session.execute(
+        select(Product.id, Product.user_id).where(Product.id.in_(product_ids))
+    ).tuples())
+    record_changes(product_owners(product_ids))
+    db.session.commit()
+    for product_id, stored, actual in drift:
+        print(f'Product {product_id}: {stored} -> {actual}')
+    print(f'Reconciled {len(drift)} product(s)')
+
+
+@app.cli.command('compact-change-log')
+@click.option('--days', type=int, help='Retention in days (default: CHANGE_LOG_RETENTION_DAYS)')
+def compact_change_log_command(days):
+    """Drop superseded and expired /sync change log entries."""
+    superseded, expired = compact(days if days is not None else app.config['CHANGE_LOG_RETENTION_DAYS'])
+    print(f'Removed {superseded} superseded and {expired} expired entries')
+
 if __name__ == '__main__':
     app.run(port=5555, debug=True)
\ No newline at end of file
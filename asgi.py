@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""ASGI entry point.
+
+POST /recipes is served on the event loop by AsyncRecipeService, so a
+slow completion call only costs a coroutine instead of a whole worker.
+Every other request goes to the Flask app through asgiref's WSGI
+adapter, run on the event loop's default thread pool.
+
+    uvicorn asgi:application --port 5555
+"""
+
+# Standard library imports
+import time
+
+# Remote library imports
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+# Local imports
+from app import app, recipe_service
+from fastjson import dumps_bytes, loads
+from metrics import http_request_duration, http_requests, http_requests_in_flight
+from recipes import (
+    AsyncRecipeService, AsyncOpenAICompletionClient, AsyncStubCompletionClient, RecipeTimeout,
+    normalize_ingredients, sse_astream
+)
+
+
+if app.config['RECIPE_CLIENT'] == 'stub':
+    async_client = AsyncStubCompletionClient()
+else:
+    async_client = AsyncOpenAICompletionClient(
+        max_connections=app.config['RECIPE_MAX_CONCURRENCY'],
+        timeout=app.config['RECIPE_TIMEOUT']
+    )
+
+# Shares the memory cache and on-disk store with the sync /recipes resource
+async_recipe_service = AsyncRecipeService(
+    client=async_client,
+    cache=recipe_service.cache,
+    store=recipe_service.store,
+    max_concurrency=app.config['RECIPE_MAX_CONCURRENCY'],
+    timeout=app.config['RECIPE_TIMEOUT']
+)
+
+class ThreadPoolWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs WSGI apps thread-sensitively, which puts every Flask
+    # request on one shared thread; run them on the loop's thread pool instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.run_wsgi_app.__wrapped__, thread_sensitive=False)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(
+            scope, receive, send
+        )
+
+
+flask_app = ThreadPoolWsgiToAsgi(app)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def cors_headers(scope):
+    # Mirrors CORS(app, supports_credentials=True) for the async route
+    origin = dict(scope['headers']).get(b'origin')
+    if not origin:
+        return []
+    return [
+        (b'access-control-allow-origin', origin),
+        (b'access-control-allow-credentials', b'true'),
+        (b'vary', b'Origin'),
+    ]
+
+
+async def send_json(scope, send, payload, status):
+    body = dumps_bytes(payload)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ] + cors_headers(scope)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def wants_sse(scope):
+    return b'text/event-stream' in dict(scope['headers']).get(b'accept', b'')
+
+
+async def send_sse(scope, send, events):
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ] + cors_headers(scope)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    async for chunk in sse_astream(events):
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def recipes(scope, receive, send):
+    try:
+        data = loads(await read_body(receive) or b'{}')
+    except ValueError:
+        return await send_json(scope, send, {'error': 'Invalid JSON body'}, 400)
+
+    try:
+        ingredients = normalize_ingredients(data.get('ingredients', '') if isinstance(data, dict) else '')
+    except ValueError as e:
+        return await send_json(scope, send, {'error': str(e)}, 400)
+    if not ingredients:
+        return await send_json(scope, send, {'error': 'Ingredients are required'}, 400)
+
+    if wants_sse(scope):
+        return await send_sse(scope, send, async_recipe_service.stream_recipes(ingredients))
+
+    try:
+        recipes_array = await async_recipe_service.get_recipes(ingredients)
+    except RecipeTimeout as e:
+        return await send_json(scope, send, {'error': str(e)}, 504)
+    except Exception as e:
+        return await send_json(scope, send, {'error': str(e)}, 500)
+
+    await send_json(scope, send, recipes_array, 200)
+
+
+async def instrumented(handler, labels, scope, receive, send):
+    # Same HTTP metrics the Flask hooks record, for routes served here
+    status = 500
+
+    async def send_and_capture(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    started = time.perf_counter()
+    http_requests_in_flight.inc(*labels)
+    try:
+        await handler(scope, receive, send_and_capture)
+    finally:
+        http_requests_in_flight.dec(*labels)
+        http_requests.inc(*labels, status)
+        http_request_duration.observe(time.perf_counter() - started, *labels)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if hasattr(async_client, 'aclose'):
+                await async_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+
+    if scope['type'] == 'http' and scope['path'] == '/recipes' and scope['method'] == 'POST':
+        return await instrumented(recipes, ('Recipes', 'POST'), scope, receive, send)
+
+    await flask_app(scope, receive, send)
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+"""HTTP benchmark for the Pantry Pal API.
+
+Seeds a database with seed.py, starts the app in a real HTTP server with
+the stub recipe client, drives every endpoint at a fixed concurrency and
+prints per-endpoint latency percentiles, throughput, SQL statement counts
+and the server's peak RSS as JSON. Write endpoints run as scenarios that
+create and delete their own rows, so the seeded data is left as it was.
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json       # exit 1 on regressions
+
+Runs are reproducible for a given --seed and scale. Absolute numbers
+are only comparable on the same machine, so keep baselines per machine.
+"""
+
+# Standard library imports
+import argparse
+import glob
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from random import Random
+
+# Remote library imports
+import httpx
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SERVERS = {
+    'uvicorn': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+                '--port', '{port}', '--log-level', 'warning'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-k', 'gthread', '--threads', '{concurrency}',
+                 '-b', '127.0.0.1:{port}', 'app:app'],
+    'werkzeug': [sys.executable, '-c', 'from app import app; app.run(port={port}, threaded=True)'],
+}
+
+INGREDIENTS = ['eggs', 'milk', 'spinach', 'cheese', 'tomato', 'rice', 'chicken', 'garlic']
+
+# Relative slowdown tolerated before a metric counts as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# One request of a scenario; only measured steps count towards the results
+Step = namedtuple('Step', 'method path json measure', defaults=(None, True))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/pantry-bench.db',
+                        help='database URI; it is reset and seeded unless --no-seed')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data already in --database')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products-per-user', type=int, default=10)
+    parser.add_argument('--items-per-product', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--server', choices=sorted(SERVERS), default='uvicorn')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per endpoint')
+    parser.add_argument('--endpoints', help='comma-separated subset of endpoint names')
+    parser.add_argument('--output', help='write the results JSON here as well as to stdout')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    return parser.parse_args()
+
+
+def max_ids(database):
+    """Highest user, product and item id; seeded ids run from 1 without gaps."""
+    engine = create_engine(database)
+    try:
+        with engine.connect() as connection:
+            return {
+                table: connection.scalar(text(f'SELECT MAX(id) FROM {table}')) or 0
+                for table in ('users', 'products', 'product_items')
+            }
+    finally:
+        engine.dispose()
+
+
+def endpoints(args, ids):
+    """Request factories per endpoint, in home page order.
+
+    Each factory takes a seeded Random and returns (method, path, json)
+    for one request, or is a generator of Steps that is sent each
+    response. ``ids`` holds the max_ids() of the data; reads stay inside
+    them so every request hits a real row, and writes only delete the
+    rows their scenario created.
+    """
+    users, products, items = ids.get('users', 0), ids.get('products', 0), ids.get('product_items', 0)
+    password = {'password': 'password'}
+
+    def new_user(rng):
+        name = f'bench{rng.getrandbits(48):x}'
+        return dict(password, username=name, email=f'{name}@example.com')
+
+    def new_product(rng):
+        return {
+            'name': f'Bench {rng.getrandbits(48):x}', 'user_id': rng.randint(1, users),
+            'category': 'Dairy', 'storage_place': 'Fridge', 'unit': 'liters',
+        }
+
+    def new_item(rng):
+        return {'product_id': rng.randint(1, products), 'brand_name': 'Bench', 'quantity': 1}
+
+    def created(path, body, measure):
+        # POST a row and return its URL
+        response = yield Step('POST', path, body, measure)
+        return f"{path}/{response.json()['id']}"
+
+    def create(path, new):
+        def scenario(rng):
+            url = yield from created(path, new(rng), True)
+            yield Step('DELETE', url, measure=False)
+        return scenario
+
+    def update(path, new, changes):
+        def scenario(rng):
+            url = yield from created(path, new(rng), False)
+            yield Step('PATCH', url, changes)
+            yield Step('DELETE', url, measure=False)
+        return scenario
+
+    def remove(path, new):
+        def scenario(rng):
+            url = yield from created(path, new(rng), False)
+            yield Step('DELETE', url)
+        return scenario
+
+    def user_update(rng):
+        # Writes back the seeded username, so only the row version moves
+        user_id = rng.randint(1, users)
+        return 'PATCH', f'/users/{user_id}', {'username': f'user{user_id}'}
+
+    def recipe(rng):
+        # A small pool of ingredient sets, so the recipe cache sees hits and misses
+        return 'POST', '/recipes', {'ingredients': rng.sample(INGREDIENTS, 2) + [f'item{rng.randint(1, 50)}']}
+
+    return {
+        'users_list': lambda rng: ('GET', '/users?limit=50', None),
+        'user_create': create('/users', new_user),
+        'user_detail': lambda rng: ('GET', f'/users/{rng.randint(1, users)}', None),
+        'user_update': user_update,
+        'user_delete': remove('/users', new_user),
+        'user_products': lambda rng: ('GET', f'/users/{rng.randint(1, users)}/products', None),
+        'user_product_items': lambda rng: ('GET', f'/users/{rng.randint(1, users)}/product_items', None),
+        'login': lambda rng: ('POST', '/login', dict(password, email=f'user{rng.randint(1, users)}@example.com')),
+        'logout': lambda rng: ('DELETE', '/logout', None),
+        'check_session': lambda rng: ('GET', '/check_session', None),
+        'products_list': lambda rng: ('GET', '/products?limit=100', None),
+        'product_create': create('/products', new_product),
+        'product_detail': lambda rng: ('GET', f'/products/{rng.randint(1, products)}', None),
+        'product_update': update('/products', new_product, {'low_limit': 3}),
+        'product_delete': remove('/products', new_product),
+        'low_stock': lambda rng: ('GET', f'/products/low_stock?user_id={rng.randint(1, users)}', None),
+        'product_items_list': lambda rng: ('GET', '/product_items?limit=100', None),
+        'product_item_create': create('/product_items', new_item),
+        'product_item_detail': lambda rng: ('GET', f'/product_items/{rng.randint(1, items)}', None),
+        'product_item_update': update('/product_items', new_item, {'quantity': 2}),
+        'product_item_delete': remove('/product_items', new_item),
+        'expiring': lambda rng: ('GET', f'/product_items/expiring?user_id={rng.randint(1, users)}', None),
+        'recipes': recipe,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_env(args):
+    return dict(
+        os.environ,
+        DATABASE_URI=args.database,
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'),
+        RECIPE_CLIENT='stub',
+        # Any budget turns on X-SQL-Query-Count; set high enough not to log
+        SQL_QUERY_BUDGET='100000',
+    )
+
+
+def seed(args, env):
+    subprocess.run(
+        [sys.executable, 'seed.py', '--reset', '--users', str(args.users),
+         '--products-per-user', str(args.products_per_user),
+         '--items-per-product', str(args.items_per_product),
+         '--seed', str(args.seed), '--start-date', date.today().isoformat()],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL
+    )
+
+
+def start_server(args, env, port):
+    command = [part.format(port=port, concurrency=args.concurrency) for part in SERVERS[args.server]]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'{args.server} exited with status {process.returncode}')
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit(f'{args.server} did not start within 30s')
+
+
+def process_tree(pid):
+    pids = [pid]
+    for children in glob.glob(f'/proc/{pid}/task/*/children'):
+        with open(children) as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of the server and its workers (Linux only)."""
+    total = 0
+    for each in process_tree(pid):
+        try:
+            with open(f'/proc/{each}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total / 1024, 1) if total else None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def single(request):
+    yield Step(*request)
+
+
+def run_scenario(client, steps, samples):
+    """Send each step, recording measured ones; a failed step ends the scenario."""
+    response = None
+    while True:
+        try:
+            step = steps.send(response)
+        except StopIteration:
+            return
+        started = time.perf_counter()
+        response = client.request(step.method, step.path, json=step.json)
+        elapsed = time.perf_counter() - started
+        failed = response.status_code >= 400
+        if step.measure or failed:
+            samples.append((
+                elapsed,
+                response.status_code,
+                response.headers.get('X-SQL-Query-Count'),
+                len(response.content),
+            ))
+        if failed:
+            steps.close()
+            return
+
+
+def run_endpoint(base_url, name, factory, args):
+    """Run --requests scenarios over --concurrency keep-alive clients."""
+    def worker(worker_id, count, measure):
+        rng = Random(f'{args.seed}:{name}:{worker_id}:{measure}')
+        samples = []
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            if name == 'check_session':
+                client.post('/login', json={'email': f'user{worker_id % args.users + 1}@example.com',
+                                            'password': 'password'})
+            for _ in range(count):
+                steps = factory(rng)
+                run_scenario(client, single(steps) if isinstance(steps, tuple) else steps, samples)
+        return samples
+
+    def run(total, measure):
+        counts = [total // args.concurrency + (i < total % args.concurrency) for i in range(args.concurrency)]
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            return [
+                sample
+                for samples in pool.map(lambda i: worker(i, counts[i], measure), range(args.concurrency))
+                for sample in samples
+            ]
+
+    run(args.warmup, False)
+    started = time.perf_counter()
+    samples = run(args.requests, True)
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _, _ in samples)
+    queries = [int(count) for _, _, count, _ in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _, _ in samples if status >= 400),
+        'throughput_rps': round(len(samples) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p90_ms': round(percentile(latencies, 90), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'sql_queries': max(queries) if queries else None,
+        'response_bytes': round(statistics.fmean(size for _, _, _, size in samples)),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human-readable regressions against baseline."""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f'{name}: {metric} {previous[metric]} -> {current[metric]}')
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}: throughput_rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+        # Statement counts are deterministic, so any increase is a regression
+        if (current['sql_queries'] or 0) > (previous['sql_queries'] or 0):
+            regressions.append(f"{name}: sql_queries {previous['sql_queries']} -> {current['sql_queries']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+
+    rss, previous_rss = results.get('peak_rss_mb'), baseline.get('peak_rss_mb')
+    if rss and previous_rss and rss > previous_rss * (1 + threshold):
+        regressions.append(f'peak_rss_mb {previous_rss} -> {rss}')
+    return regressions
+
+
+def main():
+    args = parse_args()
+    env = server_env(args)
+    names = list(endpoints(args, {}))
+    if args.endpoints:
+        unknown = set(args.endpoints.split(',')) - set(names)
+        if unknown:
+            sys.exit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        names = args.endpoints.split(',')
+
+    if not args.no_seed:
+        print('Seeding...', file=sys.stderr)
+        seed(args, env)
+    # seed.py draws a varying number of items per product, so read the real ranges
+    selected = endpoints(args, max_ids(args.database))
+    selected = {name: selected[name] for name in names}
+
+    port = free_port()
+    server = start_server(args, env, port)
+    try:
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'server': args.server,
+                'database': args.database.split(':', 1)[0],
+                'users': args.users,
+                'products_per_user': args.products_per_user,
+                'items_per_product': args.items_per_product,
+                'seed': args.seed,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+            },
+            'endpoints': {},
+        }
+        for name, factory in selected.items():
+            print(f'{name}...', file=sys.stderr)
+            results['endpoints'][name] = run_endpoint(f'http://127.0.0.1:{port}', name, factory, args)
+        results['peak_rss_mb'] = peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against baseline', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+from datetime import date
+
+from sqlalchemy import Date, Integer, String, select
+
+from models import db
+
+
+MAX_BULK_ROWS = 1000
+
+
+class BulkSchema:
+    """Validates arrays of rows for the bulk endpoints before any SQL runs.
+
+    Column types, nullability and string lengths are read from the model's
+    table once, so the rules stay in step with models.py. ``read_only``
+    columns are maintained by the server and rejected as unknown fields;
+    a default still fills them in on insert.
+    """
+
+    def __init__(self, model, required, defaults=None, read_only=()):
+        self.model = model
+        # Row versions are the server's to bump
+        self.columns = {
+            column.key: column for column in model.__table__.columns
+            if not column.primary_key and column.key != 'version' and column.key not in read_only
+        }
+        self.required = required
+        self.defaults = defaults or {}
+
+    def clean_value(self, key, value):
+        column = self.columns[key]
+
+        if value is None:
+            if not column.nullable:
+                raise ValueError(f'{key} is required')
+            return None
+
+        if isinstance(column.type, Integer):
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f'{key} must be an integer')
+        elif isinstance(column.type, String):
+            if not isinstance(value, str):
+                raise ValueError(f'{key} must be a string')
+            if column.type.length and len(value) > column.type.length:
+                raise ValueError(f'{key} must be at most {column.type.length} characters')
+        elif isinstance(column.type, Date):
+            if not isinstance(value, date):
+                try:
+                    value = date.fromisoformat(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'{key} must be a YYYY-MM-DD date')
+        return value
+
+    def clean_row(self, row, partial=False):
+        if not isinstance(row, dict):
+            raise ValueError('Each row must be an object')
+
+        unknown = set(row) - set(self.columns) - ({'id'} if partial else set())
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        if partial:
+            if isinstance(row.get('id'), bool) or not isinstance(row.get('id'), int):
+                raise ValueError('id must be an integer')
+            clean = {'id': row['id']}
+        else:
+            missing = [key for key in self.required if key not in row]
+            if missing:
+                raise ValueError(f"Missing fields: {', '.join(missing)}")
+            clean = dict(self.defaults)
+
+        for key, value in row.items():
+            if key != 'id':
+                clean[key] = self.clean_value(key, value)
+        return clean
+
+    def validate(self, rows, partial=False):
+        """Return (clean_rows, errors); errors is a list of {index, error}."""
+        if not isinstance(rows, list) or not rows:
+            return [], [{'index': None, 'error': 'Expected a non-empty array of rows'}]
+        if len(rows) > MAX_BULK_ROWS:
+            return [], [{'index': None, 'error': f'At most {MAX_BULK_ROWS} rows per request'}]
+
+        clean_rows, errors = [], []
+        for index, row in enumerate(rows):
+            try:
+                clean_rows.append(self.clean_row(row, partial))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        return clean_rows, errors
+
+
+def validate_ids(ids):
+    if not isinstance(ids, list) or not ids:
+        return [{'index': None, 'error': 'Expected a non-empty array of ids'}]
+    if len(ids) > MAX_BULK_ROWS:
+        return [{'index': None, 'error': f'At most {MAX_BULK_ROWS} rows per request'}]
+    return [
+        {'index': index, 'error': 'id must be an integer'}
+        for index, id in enumerate(ids)
+        if isinstance(id, bool) or not isinstance(id, int)
+    ]
+
+
+def missing_rows(model, pairs, label):
+    """Check (index, id) pairs against model with one query."""
+    ids = {id for _, id in pairs}
+    if not ids:
+        return []
+    found = set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+    return [
+        {'index': index, 'error': f'{label} {id} not found'}
+        for index, id in pairs
+        if id not in found
+    ]
+
+
+def duplicate_ids(ids):
+    seen = set()
+    errors = []
+    for index, id in enumerate(ids):
+        if id in seen:
+            errors.append({'index': index, 'error': f'Duplicate id {id}'})
+        seen.add(id)
+    return errors
@@ -0,0 +1,153 @@
+import hashlib
+
+from flask import request, make_response
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ChangeCounter
+
+
+# Callbacks run once a write commits, with {user_id: new user:<id> version}
+_commit_callbacks = []
+
+# The one counter behind table-wide ETags, bumped after every write commits
+TABLES_SCOPE = 'tables'
+
+counters = ChangeCounter.__table__
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def bump(*scopes):
+    """Increment the change counters for scopes in the current transaction."""
+    scopes = set(scopes)
+    if not scopes:
+        return
+
+    result = db.session.execute(
+        update(ChangeCounter)
+        .where(ChangeCounter.scope.in_(scopes))
+        .values(version=ChangeCounter.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == len(scopes):
+        return
+
+    existing = set(db.session.scalars(
+        select(ChangeCounter.scope).where(ChangeCounter.scope.in_(scopes))
+    ))
+    for scope in sorted(scopes - existing):
+        try:
+            with db.session.begin_nested():
+                db.session.add(ChangeCounter(scope=scope, version=1))
+        except IntegrityError:
+            # Another writer created it first
+            db.session.execute(
+                update(ChangeCounter)
+                .where(ChangeCounter.scope == scope)
+                .values(version=ChangeCounter.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def record_changes(user_ids=()):
+    """Call before commit on every write, with the users whose data it touches.
+
+    Bumps their user:<id> change counters, which GET ETags are built
+    from, and queues the new versions for the on-commit callbacks (cache
+    invalidation and friends), which are skipped on rollback. Only those
+    users' rows are locked, so writers for different users never wait
+    on each other.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    scopes = {user_scope(user_id): user_id for user_id in user_ids}
+    bump(*scopes)
+    if scopes:
+        versions = db.session.execute(
+            select(ChangeCounter.scope, ChangeCounter.version).where(ChangeCounter.scope.in_(scopes))
+        )
+        db.session.info.setdefault('changed_users', {}).update(
+            (scopes[scope], version) for scope, version in versions
+        )
+
+
+def on_commit(callback):
+    _commit_callbacks.append(callback)
+    return callback
+
+
+def _bump_table_version():
+    # Its own short transaction once the write has committed, so the
+    # shared row is locked for a single UPDATE, never for the length of
+    # a writer's transaction
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            update(counters)
+            .where(counters.c.scope == TABLES_SCOPE)
+            .values(version=counters.c.version + 1)
+        )
+        if result.rowcount:
+            return
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(counters).values(scope=TABLES_SCOPE, version=1))
+        except IntegrityError:
+            # Another writer created it first
+            connection.execute(
+                update(counters)
+                .where(counters.c.scope == TABLES_SCOPE)
+                .values(version=counters.c.version + 1)
+            )
+
+
+@event.listens_for(db.session, 'after_commit')
+def _run_commit_callbacks(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        _bump_table_version()
+        for callback in _commit_callbacks:
+            callback(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_users', None)
+
+
+def current_etag(scopes, version=None, depends_on=()):
+    """Weak ETag for the request URL, built from the scopes' counters.
+
+    Scopes that are table names follow the TABLES_SCOPE counter, so a
+    table-wide ETag is one primary key lookup. A row ``version`` leads
+    the tag ("3.<digest>"), so If-Match can send the tag back as is.
+    ``depends_on`` adds anything else the response changes with, such
+    as today's date.
+    """
+    counter_for = {scope: scope if ':' in scope else TABLES_SCOPE for scope in scopes}
+    versions = dict(db.session.execute(
+        select(ChangeCounter.scope, ChangeCounter.version)
+        .where(ChangeCounter.scope.in_(set(counter_for.values())))
+    ).all())
+    key = '|'.join(f'{scope}={versions.get(counter_for[scope], 0)}' for scope in sorted(counter_for))
+    key += ''.join(f'|{value}' for value in depends_on)
+    key += f'|{request.full_path}|{request.accept_mimetypes}'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return digest if version is None else f'{version}.{digest}'
+
+
+def conditional_get(scopes, build_response, version=None, depends_on=()):
+    """Answer 304 when If-None-Match matches, otherwise build and tag the response.
+
+    Only the counters are read for a 304, never the row data. Errors
+    (a 404 for a missing row) are not tagged.
+    """
+    etag = current_etag(scopes, version, depends_on)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = build_response()
+    if response.status_code < 400:
+        response.set_etag(etag, weak=True)
+    return response
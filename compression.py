@@ -0,0 +1,57 @@
+import gzip
+
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/html'}
+
+
+def choose_encoding():
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # Ties go to the order above, so br wins over gzip at equal quality
+    best = max(encodings, key=lambda encoding: request.accept_encodings[encoding])
+    return best if request.accept_encodings[best] > 0 else None
+
+
+def compress_response(response):
+    """Compress buffered responses above COMPRESS_MIN_SIZE bytes.
+
+    Streamed responses (NDJSON, Server-Sent Events) are left alone so
+    rows and tokens still reach the client as they are produced.
+    """
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, quality=current_app.config['COMPRESS_BROTLI_QUALITY']))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=current_app.config['COMPRESS_GZIP_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    app.after_request(compress_response)
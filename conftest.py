@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+
+from app import app
+from models import db
+
+
+@pytest.fixture
+def database():
+    with app.app_context():
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import time
+
+from flask import current_app, g, has_request_context, request, session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def _env_bool(environ, name, default):
+    return environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(uri, environ=os.environ):
+    """SQLAlchemy engine options from DB_* environment variables.
+
+    Pool sizing is only passed when set, so SQLAlchemy keeps choosing a
+    suitable pool for SQLite. Pre-ping is on by default so a connection
+    dropped by a failover is replaced instead of failing a request.
+    DB_STATEMENT_TIMEOUT_MS is applied per connection on PostgreSQL.
+    """
+    options = {'pool_pre_ping': _env_bool(environ, 'DB_POOL_PRE_PING', 'true')}
+    for name, key, cast in (
+        ('DB_POOL_SIZE', 'pool_size', int),
+        ('DB_MAX_OVERFLOW', 'max_overflow', int),
+        ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+        ('DB_POOL_RECYCLE', 'pool_recycle', int),
+    ):
+        if environ.get(name):
+            options[key] = cast(environ[name])
+
+    timeout = environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout and uri and make_url(uri).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def reading_from_primary():
+    # Clients that just wrote read their own writes from the primary
+    return client_session.get('read_primary_until', 0) > time.time()
+
+
+class RoutingSession(Session):
+    """Sends reads in GET/HEAD requests to the read replica, if one is bound.
+
+    Everything else (writes, flushes, other methods, CLI commands and
+    clients inside their post-write window) uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and REPLICA_BIND in self._db.engines
+            and has_request_context()
+            and request.method in READ_METHODS
+            and not reading_from_primary()
+        ):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _note_write(session):
+    # Only write paths commit; GET handlers never do
+    if has_request_context():
+        g.database_written = True
+
+
+def _pin_to_primary(response):
+    if g.get('database_written'):
+        sticky = current_app.config['REPLICA_STICKY_SECONDS']
+        client_session['read_primary_until'] = time.time() + sticky
+    return response
+
+
+def init_app(app, db):
+    """Configure engine options and the optional read replica.
+
+    Set ``DATABASE_REPLICA_URI`` to route GET/HEAD reads to a replica.
+    After a write the client reads from the primary for
+    ``REPLICA_STICKY_SECONDS`` so it sees its own changes despite lag.
+    SQLite connections enforce foreign keys, which deletes rely on to cascade.
+    """
+    if not event.contains(Engine, 'connect', _enable_sqlite_foreign_keys):
+        event.listen(Engine, 'connect', _enable_sqlite_foreign_keys)
+
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', options)
+
+    replica_uri = app.config.get('DATABASE_REPLICA_URI')
+    if replica_uri:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds[REPLICA_BIND] = dict(engine_options(replica_uri), url=replica_uri)
+
+        if app.config.setdefault('REPLICA_STICKY_SECONDS', 5):
+            if not event.contains(db.session, 'after_commit', _note_write):
+                event.listen(db.session, 'after_commit', _note_write)
+            app.after_request(_pin_to_primary)
@@ -0,0 +1,48 @@
+import re
+from datetime import timedelta
+
+from sqlalchemy import case
+
+
+MAX_WINDOW_DAYS = 366
+WINDOW_UNITS = {'d': 1, 'w': 7, 'm': 30}
+BUCKETS = ('expired', 'today', 'this_week', 'this_month', 'later')
+
+
+def parse_window(within):
+    """Parse '7d', '2w', '1m' or a bare number of days into days."""
+    match = re.fullmatch(r'(\d+)([dwm]?)', (within or '').strip().lower())
+    if not match:
+        raise ValueError("within must look like '7d', '2w' or '1m'")
+    days = int(match.group(1)) * WINDOW_UNITS[match.group(2) or 'd']
+    if days > MAX_WINDOW_DAYS:
+        raise ValueError(f'within can be at most {MAX_WINDOW_DAYS} days')
+    return days
+
+
+def bucket_for(expiry_date, today):
+    days_left = (expiry_date - today).days
+    if days_left < 0:
+        return 'expired'
+    if days_left == 0:
+        return 'today'
+    if days_left <= 7:
+        return 'this_week'
+    if days_left <= 30:
+        return 'this_month'
+    return 'later'
+
+
+def bucket_case(expiry_date, today):
+    """bucket_for() as a SQL expression on the ``expiry_date`` column."""
+    return case(
+        (expiry_date < today, 'expired'),
+        (expiry_date == today, 'today'),
+        (expiry_date <= today + timedelta(days=7), 'this_week'),
+        (expiry_date <= today + timedelta(days=30), 'this_month'),
+        else_='later'
+    )
+
+
+def window_end(today, days):
+    return today + timedelta(days=days)
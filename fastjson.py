@@ -0,0 +1,82 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+
+from flask import current_app, make_response
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+
+def _default(value):
+    # Dates go out as ISO 8601 (2024-05-01), not Flask's HTTP date format
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps_bytes(obj, pretty=False):
+    """Encode obj as UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, default=_default, option=option)
+    if pretty:
+        return json.dumps(obj, default=_default, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, pretty=False):
+    return dumps_bytes(obj, pretty).decode('utf-8')
+
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by :func:`dumps_bytes`.
+
+    Like Flask's default provider, ``compact = None`` means compact output
+    unless the app is in debug mode. Keys keep the order the serializers
+    build them in.
+    """
+
+    compact = None
+    mimetype = 'application/json'
+
+    def pretty(self):
+        return self.compact is False or (self.compact is None and self._app.debug)
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, pretty=bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, self.pretty()) + b'\n', mimetype=self.mimetype)
+
+
+def output_json(data, code, headers=None):
+    """flask-restful representation using the app's JSON provider."""
+    body = dumps_bytes(data, current_app.json.pretty()) + b'\n'
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def init_app(app, api=None):
+    app.json = FastJSONProvider(app)
+    if api is not None:
+        api.representation('application/json')(output_json)
@@ -0,0 +1,60 @@
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import Date, Integer
+
+
+MAX_FILTER_VALUES = 100
+
+# column: the model attribute; descending: bool
+Sort = namedtuple('Sort', 'column descending')
+
+
+def parse_value(column, value):
+    """Convert one query string value to the column's Python type."""
+    if isinstance(column.type, Integer):
+        if not value.lstrip('-').isdigit():
+            raise ValueError(f'{column.key} must be an integer')
+        return int(value)
+    if isinstance(column.type, Date):
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f'{column.key} must be a YYYY-MM-DD date')
+    return value
+
+
+class ListFilters:
+    """Whitelisted ?field=value filters and ?sort= keys for a list endpoint.
+
+    ``?category=Dairy&storage_place=Fridge,Pantry`` filters on equality
+    (a comma-separated list means any of them), and ``?sort=name`` or
+    ``?sort=-quantity`` orders by one column, ties broken by id so
+    keyset pagination stays stable.
+    """
+
+    def __init__(self, model, filters=(), sorts=()):
+        self.filters = {name: getattr(model, name) for name in filters}
+        self.sorts = {name: getattr(model, name) for name in sorts}
+
+    def parse(self, args):
+        """Return (conditions, sort) from request args; sort may be None."""
+        conditions = []
+        for name, column in self.filters.items():
+            raw = args.get(name)
+            if raw is None:
+                continue
+            values = [parse_value(column, value) for value in raw.split(',') if value != '']
+            if not values:
+                raise ValueError(f'{name} needs a value')
+            if len(values) > MAX_FILTER_VALUES:
+                raise ValueError(f'At most {MAX_FILTER_VALUES} values for {name}')
+            conditions.append(column == values[0] if len(values) == 1 else column.in_(values))
+
+        sort = args.get('sort')
+        if sort is not None:
+            name = sort[1:] if sort.startswith('-') else sort
+            if name not in self.sorts:
+                raise ValueError(f"sort must be one of: {', '.join(sorted(self.sorts))}, optionally prefixed with -")
+            sort = Sort(self.sorts[name], sort.startswith('-'))
+        return conditions, sort
@@ -0,0 +1,264 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Histogram buckets in seconds, and statements per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for process-local metrics; every update takes one short lock.
+
+    Label values are passed positionally in the order of ``labels``.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = dict(self._values)
+        lines.extend(self._samples(values))
+        return lines
+
+    def _samples(self, values):
+        for label_values, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labels, label_values)} {_number(value)}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for label_values, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _labels(self.labels, label_values, [('le', _number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {_number(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REGISTRY = []
+
+http_requests = Counter(
+    'http_requests_total', 'HTTP requests by resource, method and status.',
+    ('resource', 'method', 'status')
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by resource and method.',
+    ('resource', 'method')
+)
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served.',
+    ('resource', 'method')
+)
+http_request_statements = Histogram(
+    'http_request_sql_statements', 'SQL statements run per HTTP request.',
+    ('resource', 'method'), buckets=STATEMENT_BUCKETS
+)
+http_request_sql_duration = Histogram(
+    'http_request_sql_seconds', 'Time per HTTP request spent executing SQL.',
+    ('resource', 'method')
+)
+sql_statement_duration = Histogram(
+    'sql_statement_duration_seconds', 'SQL statement execution time by resource.',
+    ('resource',), buckets=SQL_BUCKETS
+)
+bcrypt_duration = Histogram(
+    'bcrypt_duration_seconds', 'bcrypt time by operation, excluding queueing.',
+    ('operation',)
+)
+bcrypt_queue_wait = Histogram(
+    'bcrypt_queue_wait_seconds', 'Time spent waiting for a bcrypt slot.',
+    ('operation',)
+)
+bcrypt_rejected = Counter(
+    'bcrypt_rejected_total', 'Password operations rejected with 429 because the pool was full.',
+    ('operation',)
+)
+upstream_duration = Histogram(
+    'recipe_upstream_duration_seconds', 'Completion API call duration by call type.',
+    ('call',), buckets=UPSTREAM_BUCKETS
+)
+upstream_errors = Counter(
+    'recipe_upstream_errors_total', 'Failed completion API calls by call type and error.',
+    ('call', 'error')
+)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def resource_name():
+    # Label by Resource class, not URL, so ids do not blow up cardinality
+    if request.url_rule is None:
+        return 'unmatched'
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, 'view_class', None)
+    return view_class.__name__ if view_class is not None else request.endpoint
+
+
+def _start_request():
+    g.metrics_labels = (resource_name(), request.method)
+    g.metrics_started = time.perf_counter()
+    g.metrics_statements = 0
+    g.metrics_sql_seconds = 0.0
+    http_requests_in_flight.inc(*g.metrics_labels)
+
+
+def _record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc):
+    labels = g.pop('metrics_labels', None)
+    if labels is None:
+        return
+    http_requests_in_flight.dec(*labels)
+    http_requests.inc(*labels, g.pop('metrics_status', 500))
+    http_request_duration.observe(time.perf_counter() - g.metrics_started, *labels)
+    http_request_statements.observe(g.metrics_statements, *labels)
+    http_request_sql_duration.observe(g.metrics_sql_seconds, *labels)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    resource = 'none'
+    if has_request_context() and 'metrics_labels' in g:
+        resource = g.metrics_labels[0]
+        g.metrics_statements += 1
+        g.metrics_sql_seconds += elapsed
+    sql_statement_duration.observe(elapsed, resource)
+
+
+class timed:
+    """Context manager observing elapsed seconds into a histogram.
+
+    Exceptions are counted in ``errors`` (labelled with the exception
+    class name) when it is given.
+    """
+
+    def __init__(self, histogram, *label_values, errors=None):
+        self.histogram = histogram
+        self.label_values = label_values
+        self.errors = errors
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        # GeneratorExit just means a streaming client went away
+        if exc_type is not None and self.errors is not None and not issubclass(exc_type, GeneratorExit):
+            self.errors.inc(*self.label_values, exc_type.__name__)
+        return False
+
+
+def metrics_view():
+    return Response(render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    """Collect request, SQL, bcrypt and upstream metrics; serve them at /metrics.
+
+    Metrics are per process, so with several workers each one reports
+    its own counts (scrape each worker or aggregate downstream).
+    """
+    for name, listener in (
+        ('before_cursor_execute', _before_cursor_execute),
+        ('after_cursor_execute', _after_cursor_execute),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
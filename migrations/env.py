@@ -96,7 +96,25 @@ def run_migrations_online():
 
     connectable = get_engine()
 
+    # indexes limited to another backend with .ddl_if(dialect=...), such as
+    # the PostgreSQL trigram indexes, are not expected on this database
+    def include_object(object, name, type_, reflected, compare_to):
+        ddl_if = getattr(object, '_ddl_if', None)
+        if type_ == 'index' and ddl_if is not None and ddl_if.dialect:
+            return connectable.dialect.name == ddl_if.dialect
+        return True
+
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
+
     with connectable.connect() as connection:
+        # Batch migrations recreate SQLite tables; with foreign keys enforced,
+        # dropping the old table would cascade into its children
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -106,6 +124,9 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+        if sqlite:
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,29 @@
+"""Add low stock partial index
+
+Revision ID: 15c730892f85
+Revises: 9dcc9dcbba10
+Create Date: 2026-10-18 13:02:57.640912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '15c730892f85'
+down_revision = '9dcc9dcbba10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Partial on PostgreSQL and SQLite; other backends get a plain user_id index
+    op.create_index(
+        'ix_products_low_stock', 'products', ['user_id'], unique=False,
+        postgresql_where=sa.text('quantity <= low_limit'),
+        sqlite_where=sa.text('quantity <= low_limit')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_products_low_stock', table_name='products')
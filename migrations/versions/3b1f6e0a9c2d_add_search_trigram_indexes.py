@@ -0,0 +1,44 @@
+"""Add search trigram indexes
+
+Revision ID: 3b1f6e0a9c2d
+Revises: de639216127f
+Create Date: 2026-10-18 16:05:12.417309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f6e0a9c2d'
+down_revision = 'de639216127f'
+branch_labels = None
+depends_on = None
+
+
+# PostgreSQL only; SQLite searches with an in-process index instead
+TRIGRAM_INDEXES = (
+    ('ix_products_name_trgm', 'products', 'name'),
+    ('ix_products_category_trgm', 'products', 'category'),
+    ('ix_product_items_brand_name_trgm', 'product_items', 'brand_name'),
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        op.create_index(
+            name, table, [column], unique=False,
+            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for name, table, _ in TRIGRAM_INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,28 @@
+"""Add foreign key and expiry indexes
+
+Revision ID: 62c10d65adc4
+Revises: 25d08430f1c8
+Create Date: 2026-10-18 09:12:41.507113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '62c10d65adc4'
+down_revision = '25d08430f1c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_products_user_id'), 'products', ['user_id'], unique=False)
+    op.create_index(op.f('ix_product_items_product_id'), 'product_items', ['product_id'], unique=False)
+    op.create_index(op.f('ix_product_items_expiry_date'), 'product_items', ['expiry_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_product_items_expiry_date'), table_name='product_items')
+    op.drop_index(op.f('ix_product_items_product_id'), table_name='product_items')
+    op.drop_index(op.f('ix_products_user_id'), table_name='products')
@@ -0,0 +1,36 @@
+"""Add change log
+
+Revision ID: 7e2a4c9d1b58
+Revises: 3b1f6e0a9c2d
+Create Date: 2026-10-18 17:42:08.261943
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2a4c9d1b58'
+down_revision = '3b1f6e0a9c2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_log_user_id_version', 'change_log', ['user_id', 'version'], unique=False)
+    op.create_index('ix_change_log_created_at', 'change_log', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_change_log_created_at', table_name='change_log')
+    op.drop_index('ix_change_log_user_id_version', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,27 @@
+"""Add product item expiry composite index
+
+Revision ID: 9dcc9dcbba10
+Revises: 62c10d65adc4
+Create Date: 2026-10-18 11:47:05.218339
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9dcc9dcbba10'
+down_revision = '62c10d65adc4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (product_id, expiry_date) also serves plain product_id lookups
+    op.create_index('ix_product_items_product_id_expiry_date', 'product_items', ['product_id', 'expiry_date'], unique=False)
+    op.drop_index(op.f('ix_product_items_product_id'), table_name='product_items')
+
+
+def downgrade():
+    op.create_index(op.f('ix_product_items_product_id'), 'product_items', ['product_id'], unique=False)
+    op.drop_index('ix_product_items_product_id_expiry_date', table_name='product_items')
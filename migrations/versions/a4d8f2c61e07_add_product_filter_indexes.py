@@ -0,0 +1,29 @@
+"""Add product filter indexes
+
+Revision ID: a4d8f2c61e07
+Revises: 7e2a4c9d1b58
+Create Date: 2026-10-18 19:03:51.530826
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d8f2c61e07'
+down_revision = '7e2a4c9d1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (user_id, category) also serves plain user_id lookups
+    op.create_index('ix_products_user_id_category', 'products', ['user_id', 'category'], unique=False)
+    op.create_index('ix_products_user_id_storage_place', 'products', ['user_id', 'storage_place'], unique=False)
+    op.drop_index(op.f('ix_products_user_id'), table_name='products')
+
+
+def downgrade():
+    op.create_index(op.f('ix_products_user_id'), 'products', ['user_id'], unique=False)
+    op.drop_index('ix_products_user_id_storage_place', table_name='products')
+    op.drop_index('ix_products_user_id_category', table_name='products')
@@ -0,0 +1,30 @@
+"""Add row versions
+
+Revision ID: c81e5b3f9a24
+Revises: a4d8f2c61e07
+Create Date: 2026-10-18 20:11:37.904152
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81e5b3f9a24'
+down_revision = 'a4d8f2c61e07'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('users', 'products', 'product_items')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
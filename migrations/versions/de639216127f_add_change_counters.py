@@ -0,0 +1,28 @@
+"""Add change counters
+
+Revision ID: de639216127f
+Revises: 15c730892f85
+Create Date: 2026-10-18 14:21:33.084415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'de639216127f'
+down_revision = '15c730892f85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_counters',
+    sa.Column('scope', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade():
+    op.drop_table('change_counters')
@@ -0,0 +1,38 @@
+"""Cascade deletes
+
+Revision ID: e5c27d84b6f1
+Revises: c81e5b3f9a24
+Create Date: 2026-10-18 21:26:45.118630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c27d84b6f1'
+down_revision = 'c81e5b3f9a24'
+branch_labels = None
+depends_on = None
+
+
+# (table, constraint, column, referred table)
+FOREIGN_KEYS = (
+    ('products', 'fk_products_user_id_users', 'user_id', 'users'),
+    ('product_items', 'fk_product_items_product_id_products', 'product_id', 'products'),
+)
+
+
+def replace_foreign_keys(ondelete):
+    for table, name, column, referred in FOREIGN_KEYS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
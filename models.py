@@ -1,34 +1,37 @@
-from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import validates
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import MetaData, UniqueConstraint
+from sqlalchemy import MetaData, UniqueConstraint, Index, text
 import re
+from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from flask_bcrypt import Bcrypt
+
+from database import RoutingSession
+from passwords import hasher
 
 
 
 # Define metadata, instantiate db
 metadata = MetaData(naming_convention={
+    "ix": "ix_%(column_0_label)s",
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
-db = SQLAlchemy(metadata=metadata)
-bcrypt = Bcrypt()
+# RoutingSession sends GET reads to the read replica when one is configured
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 
 
-class User(db.Model, SerializerMixin):
+class User(db.Model):
     __tablename__ = 'users'
 
-    serialize_rules = ('-products.user',)
-
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), nullable=False, unique=True)
     email = db.Column(db.String(255), nullable=False, unique=True)
     _password_hash = db.Column(db.String, nullable=False)
     picture = db.Column(db.String, nullable=True)
-    # Define relationship
-    products = db.relationship('Product', back_populates='user', cascade='all, delete, delete-orphan') 
+    # Bumped on every update; PATCH compares it (If-Match) to refuse lost updates
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Define relationship; the database deletes a user's products (ON DELETE CASCADE)
+    products = db.relationship('Product', back_populates='user', cascade='all, delete, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.username} | Email: {self.email}>'
@@ -59,49 +62,108 @@ class User(db.Model, SerializerMixin):
 
     @password.setter
     def password(self, plaintext_password):
-        self._password_hash = bcrypt.generate_password_hash(plaintext_password).decode('utf-8')
+        self._password_hash = hasher.hash(plaintext_password)
 
     def check_password(self, plaintext_password):
-        return bcrypt.check_password_hash(self._password_hash, plaintext_password)
+        return hasher.check(self._password_hash, plaintext_password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self._password_hash)
     
-class Product(db.Model, SerializerMixin):
+class Product(db.Model):
     __tablename__ = 'products'
 
-    serialize_rules = ('-user.products','-product_items.product')
-
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     storage_place = db.Column(db.String(50), nullable=False)
     quantity = db.Column(db.Integer, nullable=True) 
     unit = db.Column(db.String(20), nullable=False)
     low_limit = db.Column(db.Integer, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     # relationships
     user = db.relationship('User', back_populates='products')
-    product_items = db.relationship('ProductItem', back_populates='product', cascade='all, delete, delete-orphan')
-
-     # Composite unique constraint
-    __table_args__ = (UniqueConstraint('name', 'user_id', name='unique_product_per_user'),)
+    product_items = db.relationship(
+        'ProductItem', back_populates='product', cascade='all, delete, delete-orphan', passive_deletes=True
+    )
+
+    # Composite unique constraint, plus a partial index holding only the
+    # products at or below their low limit (PostgreSQL and SQLite)
+    __table_args__ = (
+        UniqueConstraint('name', 'user_id', name='unique_product_per_user'),
+        Index(
+            'ix_products_low_stock', 'user_id',
+            postgresql_where=text('quantity <= low_limit'),
+            sqlite_where=text('quantity <= low_limit')
+        ),
+        # Per-user category and storage place views (?user_id=&category=);
+        # the first also serves plain user_id lookups
+        Index('ix_products_user_id_category', 'user_id', 'category'),
+        Index('ix_products_user_id_storage_place', 'user_id', 'storage_place'),
+        # Trigram indexes for /search, PostgreSQL only (SQLite searches in process)
+        Index('ix_products_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_products_category_trgm', 'category', postgresql_using='gin',
+              postgresql_ops={'category': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
     def __repr__(self):
         return f'<Product {self.name}| Category: {self.category} | Storage Place: {self.storage_place} | Quantity: {self.quantity}>'
 
-class ProductItem(db.Model, SerializerMixin):
+class ProductItem(db.Model):
     __tablename__ = 'product_items'
 
-    serialize_rules = ('-product.product_items',)
-
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
     brand_name = db.Column(db.String(50), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    expiry_date = db.Column(db.Date, nullable=True)
+    expiry_date = db.Column(db.Date, nullable=True, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     # relationships
     product = db.relationship('Product', back_populates='product_items')
 
+    # Covers product_id lookups and per-product expiry range scans
+    __table_args__ = (
+        Index('ix_product_items_product_id_expiry_date', 'product_id', 'expiry_date'),
+        Index('ix_product_items_brand_name_trgm', 'brand_name', postgresql_using='gin',
+              postgresql_ops={'brand_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     def __repr__(self):
         return f'<ProductItem {self.brand_name} | Quantity: {self.quantity} | Expiry Date: {self.expiry_date}>'
-    
\ No newline at end of file
+    
+
+class ChangeCounter(db.Model):
+    __tablename__ = 'change_counters'
+
+    # 'user:<id>', 'sync:<id>' for the user version the change log has
+    # been compacted up to, or 'tables' for table-wide ETags
+    scope = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ChangeCounter {self.scope} | Version: {self.version}>'
+
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key: entries outlive the rows (and users) they describe
+    user_id = db.Column(db.Integer, nullable=False)
+    # The user:<id> change counter version of the write, used as the sync cursor
+    version = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_change_log_user_id_version', 'user_id', 'version'),
+        Index('ix_change_log_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<ChangeLog {self.entity} {self.entity_id} | User: {self.user_id} | Version: {self.version}>'
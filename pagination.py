@@ -0,0 +1,176 @@
+import base64
+import binascii
+import json
+from datetime import date
+from urllib.parse import urlencode
+
+from flask import request, jsonify, make_response, Response, stream_with_context
+from sqlalchemy import Date, Integer, and_, or_
+
+from fastjson import dumps_bytes
+
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    # NDJSON is opt-in, either with ?format=ndjson or an explicit Accept header
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def parse_page_args(sort=None):
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError('limit must be a positive integer')
+        limit = min(int(limit), MAX_PAGE_SIZE)
+
+    if after is not None:
+        if sort is not None:
+            after = decode_cursor(after, sort)
+        elif not after.isdigit():
+            raise ValueError('after must be a row id')
+        else:
+            after = int(after)
+
+    return limit, after
+
+
+def _nullable(sort):
+    return sort.column.property.columns[0].nullable
+
+
+def encode_cursor(value, id):
+    # Opaque to clients: the sort value and id of the last row
+    if isinstance(value, date):
+        value = value.isoformat()
+    token = base64.urlsafe_b64encode(json.dumps([value, id], separators=(',', ':')).encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if value is not None and isinstance(sort.column.type, Date):
+            value = date.fromisoformat(value)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError('after must be a cursor from X-Next-Cursor')
+    expected = int if isinstance(sort.column.type, Integer) else (date, str)
+    if (
+        isinstance(id, bool) or not isinstance(id, int)
+        or (value is not None and (isinstance(value, bool) or not isinstance(value, expected)))
+    ):
+        raise ValueError('after must be a cursor from X-Next-Cursor')
+    return value, id
+
+
+def sort_order(model, sort):
+    # NULLs sort as the largest value on every database; ties go by id
+    column = sort.column
+    if _nullable(sort):
+        order = column.desc().nulls_first() if sort.descending else column.asc().nulls_last()
+    else:
+        order = column.desc() if sort.descending else column.asc()
+    return order, model.id
+
+
+def after_sort_key(model, sort, value, id):
+    """Rows after (value, id) in sort_order, as a keyset predicate."""
+    column = sort.column
+    tie = model.id > id
+    if value is None:
+        after_nulls = and_(column.is_(None), tie)
+        return or_(after_nulls, column.isnot(None)) if sort.descending else after_nulls
+    beyond = column < value if sort.descending else column > value
+    condition = or_(beyond, and_(column == value, tie))
+    if _nullable(sort) and not sort.descending:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+
+def next_page_url(limit, cursor):
+    args = request.args.to_dict()
+    args['limit'] = limit
+    args['after'] = cursor
+    return f'{request.base_url}?{urlencode(args)}'
+
+
+def ndjson_response(query, serialize):
+    # yield_per streams rows from a server-side cursor (where the driver
+    # supports one) so only one batch is held in memory at a time
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield dumps_bytes(serialize(row)) + b'\n'
+
+    return Response(stream_with_context(generate()), 200, mimetype=NDJSON_MIMETYPE)
+
+
+def keyset_query(query, model, sort=None):
+    """Order ``query`` by the model's id, or by ``sort`` then id, and resume it from ``after``.
+
+    Returns the query and ``limit`` (None for the full list). Raises
+    ValueError on bad page arguments.
+    """
+    limit, after = parse_page_args(sort)
+
+    if sort is None:
+        query = query.order_by(model.id)
+        if after is not None:
+            query = query.filter(model.id > after)
+    else:
+        query = query.order_by(*sort_order(model, sort))
+        if after is not None:
+            query = query.filter(after_sort_key(model, sort, *after))
+    return query, limit
+
+
+def fetch_page(query, limit, sort=None):
+    """The rows of one page, and the cursor of the next one or None."""
+    if limit is None:
+        return query.all(), None
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    cursor = rows[-1].id
+    if sort is not None:
+        cursor = encode_cursor(getattr(rows[-1], sort.column.key), cursor)
+    return rows, cursor
+
+
+def set_next_page(response, limit, cursor):
+    if cursor is not None:
+        response.headers['X-Next-Cursor'] = str(cursor)
+        response.headers['Link'] = f'<{next_page_url(limit, cursor)}>; rel="next"'
+    return response
+
+
+def paginated_response(query, model, serialize, sort=None):
+    """Keyset-paginate a list query on the model's id, or on ``sort`` then id.
+
+    Without ``limit`` the full list is returned as before, so existing
+    clients keep working. With ``limit`` the response carries an
+    ``X-Next-Cursor`` header and a ``Link: rel="next"`` header when more
+    rows are available. ``after`` resumes from a previous cursor, which
+    is a row id unless the list is sorted.
+    """
+    try:
+        query, limit = keyset_query(query, model, sort)
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+
+    if wants_ndjson():
+        if limit is not None:
+            query = query.limit(limit)
+        return ndjson_response(query, serialize)
+
+    rows, cursor = fetch_page(query, limit, sort)
+    return set_next_page(make_response(jsonify([serialize(row) for row in rows]), 200), limit, cursor)
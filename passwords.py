@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+from flask import current_app, has_request_context, request
+from flask_bcrypt import Bcrypt
+from werkzeug.exceptions import TooManyRequests
+
+from metrics import bcrypt_duration, bcrypt_queue_wait, bcrypt_rejected, timed
+
+
+bcrypt = Bcrypt()
+
+
+class PasswordHasherBusy(TooManyRequests):
+    description = 'Too many password operations in progress, please retry shortly'
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool.
+
+    At most ``BCRYPT_WORKERS`` hashes run at once and at most
+    ``BCRYPT_MAX_PENDING`` more wait for a worker. When every slot is
+    taken for longer than ``BCRYPT_QUEUE_TIMEOUT`` seconds the request is
+    rejected with a 429 instead of queueing behind the rest. The cost
+    factor comes from ``BCRYPT_LOG_ROUNDS``.
+
+    The pool and its slots are per process and the request thread waits
+    for its hash, so this only protects other requests when a process
+    serves several at once: run threaded workers (``gunicorn -k gthread
+    --threads N``) or asgi.py, and keep ``BCRYPT_WORKERS +
+    BCRYPT_MAX_PENDING`` below N so some threads stay free for the other
+    endpoints. A sync worker handles one request at a time and never
+    sees back-pressure; that is logged once.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.setdefault('BCRYPT_WORKERS', os.cpu_count() or 1)
+        max_pending = app.config.setdefault('BCRYPT_MAX_PENDING', workers * 4)
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('BCRYPT_QUEUE_TIMEOUT', 0.5)
+
+        bcrypt.init_app(app)
+        app.extensions['password_hasher'] = {
+            'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt'),
+            'slots': BoundedSemaphore(workers + max_pending),
+            'warned': False,
+        }
+
+    def _run(self, operation, func, *args):
+        state = current_app.extensions['password_hasher']
+        slots = state['slots']
+
+        if not state['warned'] and has_request_context() and not request.environ.get('wsgi.multithread'):
+            state['warned'] = True
+            current_app.logger.warning(
+                'Password hashing under a single-threaded server: the bcrypt concurrency cap '
+                'and 429 back-pressure need threaded workers (gunicorn -k gthread) or asgi.py'
+            )
+
+        with timed(bcrypt_queue_wait, operation):
+            acquired = slots.acquire(timeout=current_app.config['BCRYPT_QUEUE_TIMEOUT'])
+        if not acquired:
+            bcrypt_rejected.inc(operation)
+            raise PasswordHasherBusy(retry_after=1)
+
+        try:
+            future = state['executor'].submit(self._timed, operation, func, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+    @staticmethod
+    def _timed(operation, func, *args):
+        # Timed on the worker so queueing behind other hashes is not counted
+        with timed(bcrypt_duration, operation):
+            return func(*args)
+
+    def log_rounds(self):
+        return current_app.config['BCRYPT_LOG_ROUNDS']
+
+    def hash(self, plaintext_password):
+        pw_hash = self._run('hash', bcrypt.generate_password_hash, plaintext_password, self.log_rounds())
+        return pw_hash.decode('utf-8')
+
+    def check(self, pw_hash, plaintext_password):
+        return self._run('check', bcrypt.check_password_hash, pw_hash, plaintext_password)
+
+    def needs_rehash(self, pw_hash):
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        return int(pw_hash.split('$')[2]) != self.log_rounds()
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,81 @@
+from collections import Counter
+
+from sqlalchemy import bindparam, func, select, update
+
+from models import db, Product, ProductItem
+
+
+products_table = Product.__table__
+
+
+def item_deltas(old=None, new=None):
+    """Quantity change per product for one item write.
+
+    ``old`` and ``new`` are (product_id, quantity) pairs for the item before
+    and after the write; pass None for an insert or a delete.
+    """
+    deltas = Counter()
+    if old is not None:
+        deltas[old[0]] -= old[1] or 0
+    if new is not None:
+        deltas[new[0]] += new[1] or 0
+    return deltas
+
+
+def apply_quantity_deltas(deltas):
+    """Add each delta to products.quantity in the current transaction.
+
+    Runs as one executemany UPDATE, quantity = quantity + delta, so the
+    total never needs re-summing and concurrent writers do not lose
+    each other's changes. The products' versions are bumped with it.
+    Rows are locked in product id order, so two writers touching the
+    same products cannot deadlock.
+    """
+    rows = [
+        {'product_id': product_id, 'delta': delta}
+        for product_id, delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+
+    db.session.execute(
+        update(products_table)
+        .where(products_table.c.id == bindparam('product_id'))
+        .values(
+            quantity=func.coalesce(products_table.c.quantity, 0) + bindparam('delta'),
+            version=products_table.c.version + 1
+        ),
+        rows
+    )
+
+
+def find_quantity_drift():
+    """Return (product_id, stored, actual) for products whose total is off."""
+    totals = (
+        select(ProductItem.product_id, func.sum(ProductItem.quantity).label('total'))
+        .group_by(ProductItem.product_id)
+        .subquery()
+    )
+    actual = func.coalesce(totals.c.total, 0)
+    return db.session.execute(
+        select(Product.id, Product.quantity, actual)
+        .outerjoin(totals, totals.c.product_id == Product.id)
+        .where(func.coalesce(Product.quantity, -1) != actual)
+    ).all()
+
+
+def reconcile_quantities():
+    """Reset drifted totals in the current transaction and return the drift.
+
+    The caller records the changes and commits.
+    """
+    drift = find_quantity_drift()
+    if drift:
+        db.session.execute(
+            update(products_table)
+            .where(products_table.c.id == bindparam('product_id'))
+            .values(quantity=bindparam('total'), version=products_table.c.version + 1),
+            [{'product_id': product_id, 'total': total} for product_id, _, total in sorted(drift)]
+        )
+    return drift
@@ -0,0 +1,66 @@
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_BUDGET = 10
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and 'sql_query_count' in g:
+        g.sql_query_count += 1
+
+
+def request_budget():
+    # A Resource can declare its own `query_budget`, otherwise the app default applies
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(getattr(view, 'view_class', None), 'query_budget', None)
+    return budget or current_app.config.get('SQL_QUERY_BUDGET') or DEFAULT_BUDGET
+
+
+def enabled():
+    return bool(
+        current_app.debug
+        or current_app.testing
+        or current_app.config.get('SQL_QUERY_BUDGET')
+    )
+
+
+def start_counting():
+    if enabled():
+        g.sql_query_count = 0
+
+
+def check_budget(response):
+    if 'sql_query_count' not in g:
+        return response
+
+    count = g.sql_query_count
+    budget = request_budget()
+    response.headers['X-SQL-Query-Count'] = str(count)
+
+    if count > budget:
+        message = f'{request.method} {request.path} ran {count} SQL statements (budget {budget})'
+        if current_app.config.get('SQL_QUERY_BUDGET_MODE') == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+
+    return response
+
+
+def init_app(app):
+    """Count SQL statements per request in debug/testing mode.
+
+    Enabled automatically when the app runs in debug or testing mode, or
+    whenever ``SQL_QUERY_BUDGET`` is set. Requests over budget are logged,
+    or fail with ``QueryBudgetExceeded`` when ``SQL_QUERY_BUDGET_MODE`` is
+    ``'raise'``. The count is also returned in ``X-SQL-Query-Count``.
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.before_request(start_counting)
+    app.after_request(check_budget)
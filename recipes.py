@@ -0,0 +1,456 @@
+import asyncio
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import Future
+from threading import Lock
+
+import httpx
+import openai
+
+from metrics import upstream_duration, upstream_errors, timed
+
+
+RECIPE_MODEL = 'gpt-4o-mini'
+RECIPE_MAX_TOKENS = 150
+RECIPE_PROMPT = 'Based on the following ingredients: {ingredients}, provide two recipe ideas with a brief description.'
+
+
+def normalize_ingredients(ingredients):
+    """Turn 'Eggs, milk ,eggs' or ['milk', 'Eggs'] into ['eggs', 'milk'].
+
+    The result is order-insensitive and de-duplicated, so equivalent
+    requests share one cache entry. Anything but a string or a list of
+    strings raises ValueError.
+    """
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split(',')
+    elif not isinstance(ingredients, list) or not all(isinstance(item, str) for item in ingredients):
+        raise ValueError('ingredients must be a comma-separated string or a list of strings')
+    return sorted({item.strip().lower() for item in ingredients if item.strip()})
+
+
+def build_prompt(ingredients):
+    return RECIPE_PROMPT.format(ingredients=', '.join(ingredients))
+
+
+def parse_recipes(text):
+    return text.strip().split('\n')
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def sse_stream(events):
+    """Format (event, data) pairs as Server-Sent Events.
+
+    Upstream failures after the stream has started are reported as a
+    final ``error`` event, since the status line has already been sent.
+    """
+    try:
+        for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        yield format_sse('error', {'error': str(e)})
+
+
+async def sse_astream(events):
+    try:
+        async for event, data in events:
+            yield format_sse(event, data)
+    except Exception as e:
+        yield format_sse('error', {'error': str(e)})
+
+
+class OpenAICompletionClient:
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = openai.OpenAI(timeout=self.timeout)
+        return self._client
+
+    def complete(self, prompt):
+        response = self._get_client().completions.create(
+            model=RECIPE_MODEL,
+            prompt=prompt,
+            max_tokens=RECIPE_MAX_TOKENS
+        )
+        return response.choices[0].text
+
+    def stream(self, prompt):
+        chunks = self._get_client().completions.create(
+            model=RECIPE_MODEL,
+            prompt=prompt,
+            max_tokens=RECIPE_MAX_TOKENS,
+            stream=True
+        )
+        for chunk in chunks:
+            if chunk.choices:
+                yield chunk.choices[0].text
+
+
+class AsyncOpenAICompletionClient:
+    """Async completion client sharing one pooled HTTP connection set."""
+
+    def __init__(self, max_connections=100, timeout=30.0):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections
+                    ),
+                    timeout=self.timeout
+                ),
+                max_retries=0
+            )
+        return self._client
+
+    async def complete(self, prompt):
+        response = await self._get_client().completions.create(
+            model=RECIPE_MODEL,
+            prompt=prompt,
+            max_tokens=RECIPE_MAX_TOKENS
+        )
+        return response.choices[0].text
+
+    async def stream(self, prompt):
+        chunks = await self._get_client().completions.create(
+            model=RECIPE_MODEL,
+            prompt=prompt,
+            max_tokens=RECIPE_MAX_TOKENS,
+            stream=True
+        )
+        async for chunk in chunks:
+            if chunk.choices:
+                yield chunk.choices[0].text
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class StubCompletionClient:
+    """Local stand-in for the completion API, for tests and benchmarks.
+
+    ``delay`` is the total generation time; streaming spreads it evenly
+    over the tokens.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def complete(self, prompt):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.text_for(prompt)
+
+    def stream(self, prompt):
+        self.calls += 1
+        tokens = self.tokens_for(prompt)
+        for token in tokens:
+            time.sleep(self.delay / len(tokens))
+            yield token
+
+    @classmethod
+    def tokens_for(cls, prompt):
+        return re.findall(r'\S+\s*', cls.text_for(prompt))
+
+    @staticmethod
+    def text_for(prompt):
+        ingredients = prompt.split(': ', 1)[-1].split(', provide')[0]
+        return (
+            f'1. Quick {ingredients} skillet - toss everything in a hot pan.\n'
+            f'2. Baked {ingredients} - roast at 200C for 25 minutes.'
+        )
+
+
+class AsyncStubCompletionClient(StubCompletionClient):
+    async def complete(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.text_for(prompt)
+
+    async def stream(self, prompt):
+        self.calls += 1
+        tokens = self.tokens_for(prompt)
+        for token in tokens:
+            await asyncio.sleep(self.delay / len(tokens))
+            yield token
+
+
+class SQLiteRecipeStore:
+    """On-disk recipe cache so answers survive restarts."""
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS recipes '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM recipes WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO recipes (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time() + self.ttl)
+            )
+            self._conn.execute('DELETE FROM recipes WHERE expires_at <= ?', (time.time(),))
+
+
+class RecipeService:
+    """Cached, coalescing front for the completion client.
+
+    Lookups go memory cache -> on-disk store -> upstream. Concurrent
+    requests for the same ingredient set wait on a single in-flight
+    upstream call instead of each making their own. Failures are not
+    cached.
+    """
+
+    def __init__(self, client, cache, store=None):
+        self.client = client
+        self.cache = cache
+        self.store = store
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self._inflight = {}
+        self._lock = Lock()
+
+    def _lookup(self, key):
+        recipes = self.cache.get(key)
+        if recipes is None and self.store is not None:
+            recipes = self.store.get(key)
+            if recipes is not None:
+                self.cache.set(key, recipes)
+        return recipes
+
+    def _remember(self, key, recipes):
+        self.cache.set(key, recipes)
+        if self.store is not None:
+            self.store.set(key, recipes)
+
+    def get_recipes(self, ingredients):
+        key = ','.join(ingredients)
+
+        recipes = self._lookup(key)
+        if recipes is not None:
+            return recipes
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            self.upstream_calls += 1
+            with timed(upstream_duration, 'complete', errors=upstream_errors):
+                text = self.client.complete(build_prompt(ingredients))
+            recipes = parse_recipes(text)
+            self._remember(key, recipes)
+            future.set_result(recipes)
+            return recipes
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stream_recipes(self, ingredients):
+        """Yield ('token', text) pairs as they arrive, then ('recipes', list).
+
+        A cached answer is sent as the final event straight away. Streams
+        are not coalesced, but the finished answer is cached.
+        """
+        key = ','.join(ingredients)
+
+        recipes = self._lookup(key)
+        if recipes is None:
+            self.upstream_calls += 1
+            chunks = []
+            with timed(upstream_duration, 'stream', errors=upstream_errors):
+                for text in self.client.stream(build_prompt(ingredients)):
+                    chunks.append(text)
+                    yield 'token', text
+            recipes = parse_recipes(''.join(chunks))
+            self._remember(key, recipes)
+
+        yield 'recipes', recipes
+
+    def stats(self):
+        return dict(
+            self.cache.stats(),
+            coalesced=self.coalesced,
+            upstream_calls=self.upstream_calls
+        )
+
+
+class RecipeTimeout(Exception):
+    def __init__(self, message='Recipe service timed out'):
+        super().__init__(message)
+
+
+def _fail(future, exc):
+    future.set_exception(exc)
+    # Mark it retrieved so asyncio does not log it when nobody was waiting
+    future.exception()
+
+
+class AsyncRecipeService:
+    """asyncio counterpart of RecipeService for the ASGI entry point.
+
+    Shares the memory cache and on-disk store with the sync service.
+    At most ``max_concurrency`` upstream calls run at once, and each
+    request gives up after ``timeout`` seconds, including time spent
+    waiting for a slot.
+    """
+
+    def __init__(self, client, cache, store=None, max_concurrency=200, timeout=30.0):
+        self.client = client
+        self.cache = cache
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self._inflight = {}
+        self._slots = None
+
+    async def _lookup(self, key):
+        recipes = self.cache.get(key)
+        if recipes is None and self.store is not None:
+            loop = asyncio.get_running_loop()
+            recipes = await loop.run_in_executor(None, self.store.get, key)
+            if recipes is not None:
+                self.cache.set(key, recipes)
+        return recipes
+
+    async def _remember(self, key, recipes):
+        self.cache.set(key, recipes)
+        if self.store is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.store.set, key, recipes)
+
+    def _get_slots(self):
+        # Created lazily so the semaphore binds to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    async def get_recipes(self, ingredients):
+        key = ','.join(ingredients)
+
+        recipes = await self._lookup(key)
+        if recipes is not None:
+            return recipes
+
+        loop = asyncio.get_running_loop()
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = loop.create_future()
+        try:
+            recipes = await asyncio.wait_for(self._fetch(ingredients), self.timeout)
+            await self._remember(key, recipes)
+            future.set_result(recipes)
+            return recipes
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except asyncio.TimeoutError:
+            _fail(future, RecipeTimeout())
+            raise RecipeTimeout()
+        except Exception as e:
+            _fail(future, e)
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _fetch(self, ingredients):
+        async with self._get_slots():
+            self.upstream_calls += 1
+            # A timeout shows up as CancelledError
+            with timed(upstream_duration, 'complete', errors=upstream_errors):
+                text = await self.client.complete(build_prompt(ingredients))
+            return parse_recipes(text)
+
+    async def stream_recipes(self, ingredients):
+        """Async version of RecipeService.stream_recipes.
+
+        The stream holds a concurrency slot until it finishes, and the
+        whole stream, including the wait for a slot, must complete within
+        ``timeout`` seconds.
+        """
+        key = ','.join(ingredients)
+
+        recipes = await self._lookup(key)
+        if recipes is None:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            slots = self._get_slots()
+            try:
+                await asyncio.wait_for(slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise RecipeTimeout()
+
+            tokens = self.client.stream(build_prompt(ingredients))
+            chunks = []
+            try:
+                self.upstream_calls += 1
+                with timed(upstream_duration, 'stream', errors=upstream_errors):
+                    while True:
+                        try:
+                            text = await asyncio.wait_for(tokens.__anext__(), max(deadline - loop.time(), 0))
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise RecipeTimeout()
+                        chunks.append(text)
+                        yield 'token', text
+            finally:
+                slots.release()
+                await tokens.aclose()
+
+            recipes = parse_recipes(''.join(chunks))
+            await self._remember(key, recipes)
+
+        yield 'recipes', recipes
+
+    def stats(self):
+        return dict(
+            self.cache.stats(),
+            coalesced=self.coalesced,
+            upstream_calls=self.upstream_calls,
+            max_concurrency=self.max_concurrency
+        )
@@ -0,0 +1,390 @@
+import heapq
+import re
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+from sqlalchemy import case, event, func, literal, or_, select, union_all
+
+from changes import on_commit, user_scope
+from models import db, ChangeCounter, Product, ProductItem, User
+
+
+MAX_RESULTS = 100
+# Share of the query's trigrams a fuzzy match must contain
+MIN_SIMILARITY = 0.5
+# Weight per searchable field; prefix matches score 1 + weight
+FIELD_WEIGHTS = {'name': 1.0, 'brand_name': 0.9, 'category': 0.6}
+
+_words = re.compile(r'[^\W_]+')
+
+
+def words(text):
+    return _words.findall((text or '').lower())
+
+
+@lru_cache(maxsize=65536)
+def word_trigrams(word, prefix=False):
+    """pg_trgm-style trigrams of one word, padded with two spaces in front
+    and one behind. With ``prefix`` the trailing pad is left off, so the
+    start of a word matches longer words."""
+    padded = f'  {word}' if prefix else f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex:
+    """In-process search index for SQLite, kept per user.
+
+    Trigrams point at the user's distinct words and words point at the
+    documents (product or item fields) containing them, so a query only
+    scores the vocabulary, not every row.
+
+    A user's rows are loaded on their first search and then kept current
+    by applying each committed write. Every entry remembers the user's
+    ``user:<id>`` change counter; if the database moved on without this
+    process seeing the write (another worker, a seed), the user is
+    reloaded on the next search. At most ``max_users`` users are kept.
+    """
+
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self.versions = OrderedDict()      # user_id -> counter version, in LRU order
+        self.grams = {}                    # user_id -> {trigram: set(word)}
+        self.word_fields = {}              # user_id -> {word: set((doc key, field))}
+        self.docs = {}                     # ('product'|'product_item', id) -> doc
+        self.user_products = {}            # user_id -> set(product_id)
+        self.product_owner = {}            # product_id -> user_id, for loaded users
+        self.product_items = {}            # product_id -> set(item id)
+        self._lock = Lock()
+
+    # Documents
+
+    def _add(self, key, user_id, product_id, fields):
+        fields = {name: text for name, text in fields if text}
+        self.docs[key] = {'user_id': user_id, 'product_id': product_id, 'fields': fields}
+        grams, word_fields = self.grams[user_id], self.word_fields[user_id]
+        for name, text in fields.items():
+            for word in set(words(text)):
+                entries = word_fields.get(word)
+                if entries is None:
+                    entries = word_fields[word] = set()
+                    for gram in word_trigrams(word):
+                        grams.setdefault(gram, set()).add(word)
+                entries.add((key, name))
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        grams, word_fields = self.grams[doc['user_id']], self.word_fields[doc['user_id']]
+        for name, text in doc['fields'].items():
+            for word in set(words(text)):
+                entries = word_fields.get(word)
+                if entries is None:
+                    continue
+                entries.discard((key, name))
+                if not entries:
+                    del word_fields[word]
+                    for gram in word_trigrams(word):
+                        grams[gram].discard(word)
+                        if not grams[gram]:
+                            del grams[gram]
+
+    def _put_product(self, id, user_id, name, category):
+        old_owner = self.product_owner.get(id)
+        self._remove(('product', id))
+        if old_owner is not None:
+            self.user_products[old_owner].discard(id)
+        if user_id in self.versions:
+            self.product_owner[id] = user_id
+            self.user_products[user_id].add(id)
+            self._add(('product', id), user_id, id, [('name', name), ('category', category)])
+        else:
+            self.product_owner.pop(id, None)
+        if old_owner != user_id:
+            # Items follow their product to the new owner
+            for item_id in list(self.product_items.get(id, ())):
+                doc = self.docs.get(('product_item', item_id))
+                if doc is not None:
+                    self._put_item(item_id, id, doc['fields'].get('brand_name'))
+
+    def _put_item(self, id, product_id, brand_name):
+        self._drop_item(id)
+        user_id = self.product_owner.get(product_id)
+        if user_id is not None:
+            self.product_items.setdefault(product_id, set()).add(id)
+            self._add(('product_item', id), user_id, product_id, [('brand_name', brand_name)])
+
+    def _drop_product(self, id):
+        self._remove(('product', id))
+        owner = self.product_owner.pop(id, None)
+        if owner is not None:
+            self.user_products[owner].discard(id)
+        for item_id in self.product_items.pop(id, ()):
+            self._remove(('product_item', item_id))
+
+    def _drop_item(self, id):
+        doc = self.docs.get(('product_item', id))
+        if doc is not None:
+            self.product_items.get(doc['product_id'], set()).discard(id)
+            self._remove(('product_item', id))
+
+    # Users
+
+    def _unload(self, user_id):
+        self.versions.pop(user_id, None)
+        for product_id in self.user_products.pop(user_id, ()):
+            self.product_owner.pop(product_id, None)
+            self.docs.pop(('product', product_id), None)
+            for item_id in self.product_items.pop(product_id, ()):
+                self.docs.pop(('product_item', item_id), None)
+        self.grams.pop(user_id, None)
+        self.word_fields.pop(user_id, None)
+
+    def load(self, user_id, version, products, items):
+        """Replace the user's entries with freshly queried rows."""
+        with self._lock:
+            self._unload(user_id)
+            self.versions[user_id] = version
+            self.grams[user_id] = {}
+            self.word_fields[user_id] = {}
+            self.user_products[user_id] = set()
+            for id, name, category in products:
+                self._put_product(id, user_id, name, category)
+            for id, product_id, brand_name in items:
+                self._put_item(id, product_id, brand_name)
+            while len(self.versions) > self.max_users:
+                self._unload(next(iter(self.versions)))
+
+    def is_current(self, user_id, version):
+        with self._lock:
+            if self.versions.get(user_id) != version:
+                return False
+            self.versions.move_to_end(user_id)
+            return True
+
+    def apply(self, ops, versions):
+        """Apply one committed transaction's changes.
+
+        ``versions`` maps each touched user to their new counter version.
+        Users whose entry is not exactly one version behind missed a
+        write and are dropped, to be reloaded on their next search.
+        """
+        with self._lock:
+            for user_id, version in versions.items():
+                if user_id in self.versions and self.versions[user_id] != version - 1:
+                    self._unload(user_id)
+
+            for op, *args in ops:
+                if op == 'product':
+                    self._put_product(*args)
+                elif op == 'product_item':
+                    self._put_item(*args)
+                elif op == 'delete_product':
+                    self._drop_product(*args)
+                elif op == 'delete_product_item':
+                    self._drop_item(*args)
+                elif op == 'delete_user':
+                    self._unload(*args)
+
+            for user_id, version in versions.items():
+                if user_id in self.versions:
+                    self.versions[user_id] = version
+
+    def _match_word(self, user_id, query_word):
+        """Score each of the user's words against one query word.
+
+        Prefix matches score 1, otherwise the share of the query word's
+        trigrams the word contains.
+        """
+        query_grams = word_trigrams(query_word, prefix=True)
+        grams = self.grams.get(user_id, {})
+        hits = Counter()
+        for gram in query_grams:
+            hits.update(grams.get(gram, ()))
+        needed = MIN_SIMILARITY * len(query_grams)
+        return {
+            word: 1.0 if word.startswith(query_word) else count / len(query_grams)
+            for word, count in hits.items()
+            if count >= needed
+        }
+
+    def search(self, user_id, query, limit):
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        with self._lock:
+            word_fields = self.word_fields.get(user_id, {})
+            # Every query word must match a word of the same field
+            scores = None
+            for query_word in query_words:
+                best = {}
+                for word, score in self._match_word(user_id, query_word).items():
+                    for entry in word_fields[word]:
+                        if score > best.get(entry, 0):
+                            best[entry] = score
+                if scores is None:
+                    scores = best
+                else:
+                    scores = {entry: scores[entry] + score for entry, score in best.items() if entry in scores}
+                if not scores:
+                    return []
+
+            per_doc = {}
+            for (key, field), total in scores.items():
+                weight = FIELD_WEIGHTS[field]
+                mean = total / len(query_words)
+                score = 1 + weight if mean == 1.0 else weight * mean
+                if score >= MIN_SIMILARITY and score > per_doc.get(key, (0,))[0]:
+                    per_doc[key] = (score, field)
+
+            top = heapq.nsmallest(
+                limit, per_doc.items(),
+                key=lambda entry: (-entry[1][0], self.docs[entry[0]]['fields'][entry[1][1]], entry[0][1])
+            )
+            return [
+                result(key[0], key[1], self.docs[key]['product_id'], field, self.docs[key]['fields'][field], score)
+                for key, (score, field) in top
+            ]
+
+
+def result(type, id, product_id, field, text, score):
+    return {
+        'type': type,
+        'id': id,
+        'product_id': product_id,
+        'field': field,
+        'text': text,
+        'score': round(score, 3),
+    }
+
+
+index = TrigramIndex()
+
+
+def _ops():
+    return db.session.info.setdefault('search_ops', [])
+
+
+def stage_products(products):
+    """Queue products written outside the unit of work (bulk endpoints)."""
+    _ops().extend(('product', p.id, p.user_id, p.name, p.category) for p in products)
+
+
+def stage_items(items):
+    _ops().extend(('product_item', i.id, i.product_id, i.brand_name) for i in items)
+
+
+DELETE_OPS = {User: 'delete_user', Product: 'delete_product', ProductItem: 'delete_product_item'}
+
+
+def stage_deleted(model, ids):
+    """Queue rows deleted outside the unit of work, with their cascaded children."""
+    _ops().extend((DELETE_OPS[model], id) for id in ids)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _stage_flushed(session, flush_context):
+    ops = session.info.setdefault('search_ops', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product):
+            ops.append(('product', obj.id, obj.user_id, obj.name, obj.category))
+        elif isinstance(obj, ProductItem):
+            ops.append(('product_item', obj.id, obj.product_id, obj.brand_name))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            ops.append(('delete_product', obj.id))
+        elif isinstance(obj, ProductItem):
+            ops.append(('delete_product_item', obj.id))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_staged(session):
+    session.info.pop('search_ops', None)
+
+
+@on_commit
+def _apply_staged(versions):
+    index.apply(db.session.info.pop('search_ops', []), versions)
+
+
+def _search_sqlite(user_id, query, limit):
+    version = db.session.scalar(
+        select(ChangeCounter.version).where(ChangeCounter.scope == user_scope(user_id))
+    ) or 0
+    if not index.is_current(user_id, version):
+        products = db.session.execute(
+            select(Product.id, Product.name, Product.category).where(Product.user_id == user_id)
+        ).all()
+        items = db.session.execute(
+            select(ProductItem.id, ProductItem.product_id, ProductItem.brand_name)
+            .join(Product, Product.id == ProductItem.product_id)
+            .where(Product.user_id == user_id)
+        ).all()
+        index.load(user_id, version, products, items)
+    return index.search(user_id, query, limit)
+
+
+def _escape_like(value):
+    # '/' like SQLAlchemy's autoescape, so no backslash quoting rules apply
+    return value.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+
+def _search_postgres(user_id, query, limit):
+    # Prefix of any word (ILIKE) or pg_trgm word similarity (<%), both
+    # served by the gin_trgm_ops indexes. The query is matched literally
+    prefix = f'{_escape_like(query)}%'
+    word_prefix = f'% {_escape_like(query)}%'
+    # <% filters at this setting; match the in-process index's cut-off
+    db.session.execute(
+        select(func.set_config('pg_trgm.word_similarity_threshold', str(MIN_SIMILARITY), True))
+    )
+
+    def prefixed(column):
+        return or_(column.ilike(prefix, escape='/'), column.ilike(word_prefix, escape='/'))
+
+    def matches(column):
+        return or_(prefixed(column), literal(query).op('<%')(column))
+
+    def scored(column, weight):
+        return case(
+            (prefixed(column), 1 + weight),
+            else_=weight * func.word_similarity(query, column)
+        )
+
+    name_score = scored(Product.name, FIELD_WEIGHTS['name'])
+    category_score = scored(Product.category, FIELD_WEIGHTS['category'])
+    products = (
+        select(
+            literal('product').label('type'), Product.id, Product.id.label('product_id'),
+            case((name_score >= category_score, 'name'), else_='category').label('field'),
+            case((name_score >= category_score, Product.name), else_=Product.category).label('text'),
+            func.greatest(name_score, category_score).label('score'),
+        )
+        .where(Product.user_id == user_id, or_(matches(Product.name), matches(Product.category)))
+    )
+    items = (
+        select(
+            literal('product_item').label('type'), ProductItem.id, ProductItem.product_id,
+            literal('brand_name').label('field'), ProductItem.brand_name.label('text'),
+            scored(ProductItem.brand_name, FIELD_WEIGHTS['brand_name']).label('score'),
+        )
+        .join(Product, Product.id == ProductItem.product_id)
+        .where(Product.user_id == user_id, matches(ProductItem.brand_name))
+    )
+    combined = union_all(products, items).subquery()
+    rows = db.session.execute(
+        select(combined)
+        .where(combined.c.score >= MIN_SIMILARITY)
+        .order_by(combined.c.score.desc(), combined.c.text, combined.c.id)
+        .limit(limit)
+    )
+    return [result(row.type, row.id, row.product_id, row.field, row.text, float(row.score)) for row in rows]
+
+
+def search(user_id, query, limit=20):
+    """Ranked matches on product names, categories and item brand names."""
+    if db.engine.dialect.name == 'postgresql':
+        return _search_postgres(user_id, query, limit)
+    return _search_sqlite(user_id, query, limit)
@@ -1,131 +1,274 @@
 #!/usr/bin/env python3
 
+"""Deterministic synthetic data for development and load testing.
+
+    python seed.py --reset                      # small dev dataset
+    python seed.py --reset --users 100000       # ~2M rows
+
+The same --seed and --start-date always produce the same rows. Rows are
+written with chunked Core executemany inserts (PostgreSQL COPY with
+--copy) and explicit ids, so nothing has to be read back between chunks.
+"""
+
 # Standard library imports
-from random import randint, choice
-from faker import Faker
+import argparse
+import csv
+import io
+import sys
+import time
 from datetime import date, timedelta
+from random import Random
+
+# Remote library imports
+from sqlalchemy import func, insert, inspect, select, text, update
 
 # Local imports
-from app import app, db  # Import Flask app and db instance
-from models import User, Product, ProductItem  # Import User, Product, and ProductItem models
+from app import app, db
+from changes import TABLES_SCOPE, user_scope
+from models import ChangeCounter, User, Product, ProductItem
+from passwords import hasher
+from sync import sync_scope
 
-if __name__ == '__main__':
-    fake = Faker()
-    
-    # Initialize Flask app context
-    with app.app_context():
-        print("Starting seed...")
-        
-        # Clear existing data (optional)
-        db.drop_all()
+# Category-Product Mappings
+category_product_map = {
+    'Fruits': ['Apple', 'Banana', 'Orange', 'Grapes'],
+    'Vegetables': ['Carrot', 'Broccoli', 'Spinach', 'Potato'],
+    'Dairy': ['Milk', 'Cheese', 'Yogurt', 'Butter'],
+    'Meat': ['Chicken Breast', 'Beef Steak', 'Pork Chops', 'Ground Beef'],
+    'Beverages': ['Orange Juice', 'Coffee', 'Tea', 'Soda']
+}
+
+# Storage Places Mapping
+category_storage_map = {
+    'Fruits': ['Pantry', 'Fridge'],
+    'Vegetables': ['Pantry', 'Fridge'],
+    'Dairy': ['Fridge'],
+    'Meat': ['Fridge', 'Freezer'],
+    'Beverages': ['Fridge']
+}
+
+# Units mapping
+units = {
+    'Fruits': 'pieces',
+    'Vegetables': 'pieces',
+    'Dairy': 'liters',
+    'Meat': 'kilograms',
+    'Beverages': 'liters'
+}
+
+brand_names = [
+    'Acme Foods', 'Green Valley', 'Sunrise Farms', 'Blue Ridge', 'Golden Harvest',
+    'Fresh Fields', 'Hilltop', 'River Bend', 'Old Mill', 'Maple Grove'
+]
+
+catalogue = [
+    (name, category)
+    for category, names in category_product_map.items()
+    for name in names
+]
+
+# Share of products generated at or below their low limit
+LOW_STOCK_RATIO = 0.1
+# Expiry dates fall this many days around --start-date
+EXPIRY_RANGE = (-14, 365)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--products-per-user', type=int, default=5)
+    parser.add_argument('--items-per-product', type=int, default=3,
+                        help='average; each product gets 1 to 2n-1 items')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--start-date', type=date.fromisoformat, default=date.today(),
+                        help='YYYY-MM-DD that expiry dates are spread around (default: today)')
+    parser.add_argument('--password', default='password',
+                        help='password shared by every generated user')
+    parser.add_argument('--batch-size', type=int, default=20000,
+                        help='approximate rows per transaction')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and recreate all tables (except change counters) first')
+    parser.add_argument('--copy', action='store_true',
+                        help='load with COPY instead of INSERT (PostgreSQL only)')
+    return parser.parse_args()
+
+
+def next_ids():
+    return [
+        (db.session.scalar(select(func.max(model.id))) or 0) + 1
+        for model in (User, Product, ProductItem)
+    ]
+
+
+def generate_user(rng, args, ids, password_hash):
+    """Return the user, product and item rows for one user.
+
+    ``ids`` holds the next user, product and item ids and is advanced in
+    place. Product quantities are the sum of their items, as the write
+    endpoints keep them.
+    """
+    user_id = ids[0]
+    ids[0] += 1
+    user = {
+        'id': user_id,
+        'username': f'user{user_id}',
+        'email': f'user{user_id}@example.com',
+        '_password_hash': password_hash,
+        'picture': 'https://picsum.photos/983/458',
+    }
+
+    products, items = [], []
+    for n in range(args.products_per_user):
+        name, category = catalogue[(n + user_id) % len(catalogue)]
+        # Names are unique per user, so repeat the catalogue with a suffix
+        if n >= len(catalogue):
+            name = f'{name} {n // len(catalogue) + 1}'
+
+        product_id = ids[1]
+        ids[1] += 1
+        quantity = 0
+        count = rng.randint(1, 2 * args.items_per_product - 1) if args.items_per_product > 0 else 0
+        for _ in range(count):
+            item_quantity = rng.randint(1, 5)
+            quantity += item_quantity
+            items.append({
+                'id': ids[2],
+                'product_id': product_id,
+                'brand_name': rng.choice(brand_names),
+                'quantity': item_quantity,
+                'expiry_date': args.start_date + timedelta(days=rng.randint(*EXPIRY_RANGE)),
+            })
+            ids[2] += 1
+
+        low_stock = rng.random() < LOW_STOCK_RATIO
+        products.append({
+            'id': product_id,
+            'name': name,
+            'user_id': user_id,
+            'category': category,
+            'storage_place': rng.choice(category_storage_map[category]),
+            'quantity': quantity,
+            'unit': units.get(category, 'unit'),
+            'low_limit': quantity if low_stock else rng.randint(1, 2),
+        })
+
+    return user, products, items
+
+
+def copy_rows(connection, table, rows):
+    buffer = io.StringIO()
+    # Columns left out of the rows (like version) keep their server defaults
+    columns = [column.name for column in table.columns if column.name in rows[0]]
+    writer = csv.writer(buffer)
+    for row in rows:
+        # Empty unquoted CSV fields load as NULL
+        writer.writerow([row.get(column) for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def write_batch(args, users, products, items):
+    with db.engine.begin() as connection:
+        for model, rows in ((User, users), (Product, products), (ProductItem, items)):
+            if not rows:
+                continue
+            if args.copy:
+                copy_rows(connection, model.__table__, rows)
+            else:
+                connection.execute(insert(model.__table__), rows)
+
+
+def reset_sequences():
+    # Explicit ids do not advance PostgreSQL serial sequences
+    for model in (User, Product, ProductItem):
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+        ))
+
+
+def advance_counters(user_ids):
+    """Move the users' user:<id> and sync:<id> counters past every version issued.
+
+    ETags and search index entries from before the seed no longer match
+    and /sync cursors get 410 (resync from scratch). The table-wide
+    counter is advanced with them.
+    """
+    version = (db.session.scalar(select(func.max(ChangeCounter.version))) or 0) + 1
+    scopes = {scope for user_id in user_ids for scope in (user_scope(user_id), sync_scope(user_id))}
+    scopes.add(TABLES_SCOPE)
+    existing = set(db.session.scalars(select(ChangeCounter.scope))) & scopes
+    rows = [{'scope': scope, 'version': version} for scope in sorted(scopes)]
+    if existing:
+        db.session.execute(update(ChangeCounter), [row for row in rows if row['scope'] in existing])
+    if len(existing) < len(rows):
+        db.session.execute(insert(ChangeCounter), [row for row in rows if row['scope'] not in existing])
+
+
+def seed(args):
+    dialect = db.engine.dialect.name
+    if args.copy and dialect != 'postgresql':
+        sys.exit('--copy needs a PostgreSQL database')
+
+    reset_user_ids = set()
+    if args.reset:
+        # Counters survive the reset so versions keep growing; every user
+        # that had one gets it advanced along with the new users
+        if inspect(db.engine).has_table(ChangeCounter.__tablename__):
+            scopes = db.session.scalars(select(ChangeCounter.scope).where(ChangeCounter.scope.startswith('user:')))
+            reset_user_ids = {int(scope.split(':', 1)[1]) for scope in scopes}
+        db.session.commit()
+        tables = [table for table in db.metadata.sorted_tables if table is not ChangeCounter.__table__]
+        db.metadata.drop_all(db.engine, tables=tables)
         db.create_all()
-        
-        # Seed users
-        users = []
-        for _ in range(2):
-            user = User(
-                username=fake.user_name(),
-                email=fake.email(),
-                password=fake.password(),
-                picture="https://picsum.photos/983/458" # Add a fake picture URL for each user
-            )
+
+    rng = Random(args.seed)
+    ids = next_ids()
+    first_user_id = ids[0]
+    # One bcrypt hash for everyone; hashing per user would dominate the run
+    password_hash = hasher.hash(args.password)
+
+    rows_per_user = 1 + args.products_per_user * (1 + max(args.items_per_product, 0))
+    users_per_batch = max(1, args.batch_size // rows_per_user)
+    totals = {'users': 0, 'products': 0, 'product_items': 0}
+    started = time.perf_counter()
+
+    for batch_start in range(0, args.users, users_per_batch):
+        users, products, items = [], [], []
+        for _ in range(min(users_per_batch, args.users - batch_start)):
+            user, user_products, user_items = generate_user(rng, args, ids, password_hash)
             users.append(user)
-        
-        dan = User(
-            username='dan',
-            email='danspmunene@gmail.com',
-            password="munene",
-            picture="https://picsum.photos/983/458" # Add a fake picture URL for each user 
-        )
-        users.append(dan)
+            products.extend(user_products)
+            items.extend(user_items)
 
-        for user in users:
-            db.session.add(user)
+        write_batch(args, users, products, items)
 
-        db.session.commit()
-        
-        # Category-Product Mappings
-        category_product_map = {
-            'Fruits': ['Apple', 'Banana', 'Orange', 'Grapes'],
-            'Vegetables': ['Carrot', 'Broccoli', 'Spinach', 'Potato'],
-            'Dairy': ['Milk', 'Cheese', 'Yogurt', 'Butter'],
-            'Meat': ['Chicken Breast', 'Beef Steak', 'Pork Chops', 'Ground Beef'],
-            'Beverages': ['Orange Juice', 'Coffee', 'Tea', 'Soda']
-        }
-        
-        # Storage Places Mapping
-        category_storage_map = {
-            'Fruits': ['Pantry', 'Fridge'],
-            'Vegetables': ['Pantry', 'Fridge'],
-            'Dairy': ['Fridge'],
-            'Meat': ['Fridge', 'Freezer'],
-            'Beverages': ['Fridge']
-        }
-        
-        # Units mapping
-        units = {
-            'Fruits': 'pieces',
-            'Vegetables': 'pieces',
-            'Dairy': 'liters',
-            'Meat': 'kilograms',
-            'Beverages': 'liters'
-        }
-        
-        # Seed products
-        products = []
-        for user in users:
-            for category, products_list in category_product_map.items():
-                # Choose a product from the category
-                product_name = choice(products_list)
-                
-                # Choose a suitable storage place for the category
-                storage_place = choice(category_storage_map[category])
-                
-                # Generate a random quantity and unit for the product
-                quantity = randint(1, 10)
-                low_limit = randint(1, 2)
-                unit = units.get(category, 'unit')
-                
-                product = Product(
-                    name=product_name,
-                    category=category,
-                    storage_place=storage_place,
-                    quantity=quantity,
-                    unit=unit,
-                    low_limit=low_limit,
-                    user_id=user.id
-                )
-                db.session.add(product)
-                products.append(product)
+        totals['users'] += len(users)
+        totals['products'] += len(products)
+        totals['product_items'] += len(items)
+        elapsed = time.perf_counter() - started
+        print(
+            f"\r{totals['users']:,}/{args.users:,} users, {totals['products']:,} products, "
+            f"{totals['product_items']:,} items ({sum(totals.values()) / elapsed:,.0f} rows/s)",
+            end='', flush=True
+        )
 
-        db.session.commit()
+    if dialect == 'postgresql':
+        reset_sequences()
+    # Invalidate ETags, search entries and /sync cursors handed out before the seed
+    advance_counters(reset_user_ids | set(range(first_user_id, ids[0])))
+    db.session.commit()
 
-        # Seed product items and ensure quantity matches
-        for product in products:
-            # Calculate the total quantity needed
-            total_quantity = product.quantity
-            product_items_count = randint(1, 5)  # Ensure at least one product item
-
-            total_product_items_quantity = 0
-            for _ in range(product_items_count):
-                brand_name = fake.company()
-                quantity = randint(1, 5)
-                expiry_date = fake.date_between(start_date="today", end_date="+1y")
-                
-                # Accumulate the quantity of product items
-                total_product_items_quantity += quantity
-
-                product_item = ProductItem(
-                    product_id=product.id,
-                    brand_name=brand_name,
-                    quantity=quantity,
-                    expiry_date=expiry_date
-                )
-                db.session.add(product_item)
-
-            # Update the product quantity to match the total quantity of product items
-            product.quantity = total_product_items_quantity
+    print(f'\nSeeded {sum(totals.values()):,} rows in {time.perf_counter() - started:.1f}s')
 
-        db.session.commit()
 
+if __name__ == '__main__':
+    args = parse_args()
+
+    # Initialize Flask app context
+    with app.app_context():
+        print("Starting seed...")
+        seed(args)
         print("Seed completed!")
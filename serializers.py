@@ -0,0 +1,249 @@
+from functools import lru_cache
+
+from flask import request, jsonify, make_response, abort
+from sqlalchemy import Date, DateTime, inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from models import User, Product, ProductItem
+
+
+# Serializers are looked up by name so relationships can point at each other
+SERIALIZERS = {}
+MAX_DEPTH = 3
+# Compiled projections kept per serializer; clients choose the shapes
+MAX_COMPILED = 256
+
+
+def _converter(column_type):
+    if isinstance(column_type, (Date, DateTime)):
+        return lambda value: value.isoformat()
+    return None
+
+
+class Serializer:
+    """Flat, precompiled serializer for one model.
+
+    The column list is read from the mapper once at import time, and the
+    nested shape for a given ``include``/``depth`` is compiled once and
+    kept in a bounded LRU keyed on the parsed shape, so serializing a row
+    is a plain attribute walk. Relationships
+    are only touched when they are asked for, and each one declares the
+    eager-loading strategy used to fetch it.
+
+    ``fields`` narrows the columns per level (``name,product_items.brand_name``)
+    and the SELECT with them; ``id`` is always kept.
+    """
+
+    def __init__(self, name, model, exclude=(), relationships=None):
+        self.name = name
+        self.model = model
+        self.columns = tuple(
+            (attr.key, _converter(attr.columns[0].type))
+            for attr in inspect(model).column_attrs
+            if attr.key not in exclude
+        )
+        self.column_names = frozenset(key for key, _ in self.columns)
+        # relationship name -> (serializer name, back reference, 'selectin' or 'joined')
+        self.relationships = relationships or {}
+        self._compiled = lru_cache(maxsize=MAX_COMPILED)(self._compile)
+        SERIALIZERS[name] = self
+
+    def parse_include(self, include):
+        tree = {}
+        for path in filter(None, (part.strip() for part in include.split(','))):
+            serializer, node = self, tree
+            for name in path.split('.'):
+                if name not in serializer.relationships:
+                    raise ValueError(f"Cannot include '{path}' on {self.name}")
+                node = node.setdefault(name, {})
+                serializer = SERIALIZERS[serializer.relationships[name][0]]
+        return tree
+
+    def parse_fields(self, fields, tree):
+        # relationship path -> picked column names, for the levels that pick any
+        picked = {}
+        for spec in filter(None, (part.strip() for part in fields.split(','))):
+            *path, column = spec.split('.')
+            serializer = self
+            for name in path:
+                if name not in serializer.relationships:
+                    raise ValueError(f"Unknown field '{spec}' on {self.name}")
+                serializer = SERIALIZERS[serializer.relationships[name][0]]
+            if column not in serializer.column_names:
+                raise ValueError(f"Unknown field '{spec}' on {self.name}")
+            node = tree
+            for i, name in enumerate(path):
+                if name not in node:
+                    raise ValueError(f"Include '{'.'.join(path[:i + 1])}' to pick '{spec}'")
+                node = node[name]
+            picked.setdefault(tuple(path), {'id'}).add(column)
+        return picked
+
+    def expand(self, depth, back=None):
+        # Expand every relationship up to depth levels, without walking
+        # straight back to the parent we came from
+        if depth <= 0:
+            return {}
+        return {
+            name: SERIALIZERS[target].expand(depth - 1, back=back_name)
+            for name, (target, back_name, _) in self.relationships.items()
+            if name != back
+        }
+
+    def compile(self, include=None, depth=None, fields=None, required_fields=()):
+        tree = self.parse_include(include or '')
+        if depth:
+            _merge(tree, self.expand(depth))
+        picked = self.parse_fields(fields or '', tree)
+        # Selected for the handler, but left out of the output
+        required = tuple(sorted(set(required_fields) - picked[()])) if () in picked else ()
+        # Spellings of the same shape (order, repeats, spaces) share one entry
+        return self._compiled(
+            _freeze(tree),
+            tuple(sorted((path, tuple(sorted(columns))) for path, columns in picked.items())),
+            required,
+        )
+
+    def _compile(self, tree, picked, required):
+        tree = _thaw(tree)
+        picked = {path: set(columns) for path, columns in picked}
+        selected = {**picked, (): picked[()] | set(required)} if required else picked
+        return Projection(
+            self._build(tree, picked),
+            self._options(tree, selected),
+            self._tables(tree),
+            # A flat projection is a plain column SELECT, with no ORM objects
+            None if tree else tuple(getattr(self.model, key) for key in self._keys(selected.get(())))
+        )
+
+    def _keys(self, picked, tree=()):
+        # Picked columns in declaration order, plus the foreign keys that
+        # included relationships load through
+        if picked is None:
+            return [key for key, _ in self.columns]
+        keys = set(picked)
+        for name in tree:
+            keys.update(column.key for column in self.model.__mapper__.relationships[name].local_columns)
+        return [attr.key for attr in inspect(self.model).column_attrs if attr.key in keys]
+
+    def _tables(self, tree):
+        tables = {self.model.__tablename__}
+        for name, subtree in tree.items():
+            tables |= SERIALIZERS[self.relationships[name][0]]._tables(subtree)
+        return frozenset(tables)
+
+    def _options(self, tree, picked, path=()):
+        options = []
+        # Related rows only ever feed the serializer, so they never load
+        # excluded columns; the top level stays whole for handlers
+        if path or path in picked:
+            options.append(load_only(*(getattr(self.model, key) for key in self._keys(picked.get(path), tree))))
+        for name, subtree in tree.items():
+            target, _, strategy = self.relationships[name]
+            attr = getattr(self.model, name)
+            loader = joinedload(attr) if strategy == 'joined' else selectinload(attr)
+            children = SERIALIZERS[target]._options(subtree, picked, path + (name,))
+            options.append(loader.options(*children) if children else loader)
+        return tuple(options)
+
+    def _build(self, tree, picked, path=()):
+        columns = self.columns
+        if path in picked:
+            columns = tuple(column for column in columns if column[0] in picked[path])
+        nested = tuple(
+            (name, SERIALIZERS[self.relationships[name][0]]._build(subtree, picked, path + (name,)),
+             self.model.__mapper__.relationships[name].uselist)
+            for name, subtree in tree.items()
+        )
+
+        def serialize(obj):
+            data = {}
+            for key, convert in columns:
+                value = getattr(obj, key)
+                data[key] = convert(value) if convert and value is not None else value
+            for name, child, uselist in nested:
+                value = getattr(obj, name)
+                if uselist:
+                    data[name] = [child(item) for item in value]
+                else:
+                    data[name] = child(value) if value is not None else None
+            return data
+
+        return serialize
+
+
+class Projection:
+    """A compiled serializer plus the loader options it needs.
+
+    ``tables`` names every table the output reads from, which is what a
+    response's ETag has to depend on. ``columns`` is set for flat
+    projections, which query just those columns as rows.
+    """
+
+    __slots__ = ('serialize', 'options', 'tables', 'columns')
+
+    def __init__(self, serialize, options, tables, columns=None):
+        self.serialize = serialize
+        self.options = options
+        self.tables = tables
+        self.columns = columns
+
+    def __call__(self, obj):
+        return self.serialize(obj)
+
+    def query(self, model):
+        if self.columns:
+            return model.query.with_entities(*self.columns)
+        return model.query.options(*self.options)
+
+
+def request_serializer(serializer, default_include=None, required_fields=()):
+    """Compile a serializer from the request's ?include=, ?depth= and ?fields= args.
+
+    ``required_fields`` are top-level columns kept in a narrowed SELECT
+    for handlers that read them; they are only serialized when picked.
+    """
+    include = request.args.get('include', default_include)
+    depth = request.args.get('depth', '0')
+    fields = request.args.get('fields')
+
+    if not depth.isdigit() or int(depth) > MAX_DEPTH:
+        abort(make_response(jsonify({'error': f'depth must be between 0 and {MAX_DEPTH}'}), 400))
+
+    try:
+        return serializer.compile(include, int(depth), fields, required_fields)
+    except ValueError as e:
+        abort(make_response(jsonify({'error': str(e)}), 400))
+
+
+def _merge(tree, other):
+    for name, subtree in other.items():
+        _merge(tree.setdefault(name, {}), subtree)
+
+
+def _freeze(tree):
+    return tuple(sorted((name, _freeze(subtree)) for name, subtree in tree.items()))
+
+
+def _thaw(tree):
+    return {name: _thaw(subtree) for name, subtree in tree}
+
+
+user_serializer = Serializer(
+    'user', User,
+    exclude=('_password_hash',),
+    relationships={'products': ('product', 'user', 'selectin')},
+)
+
+product_serializer = Serializer(
+    'product', Product,
+    relationships={
+        'user': ('user', 'products', 'joined'),
+        'product_items': ('product_item', 'product', 'selectin'),
+    },
+)
+
+product_item_serializer = Serializer(
+    'product_item', ProductItem,
+    relationships={'product': ('product', 'product_items', 'joined')},
+)
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.orm import aliased
+
+from changes import record_changes, user_scope
+from models import db, ChangeCounter, ChangeLog, Product, ProductItem
+from serializers import product_serializer, product_item_serializer
+
+
+PRODUCT = 'product'
+PRODUCT_ITEM = 'product_item'
+
+
+class CursorExpired(Exception):
+    """The entries after a cursor were compacted away; resync from scratch."""
+
+
+def sync_scope(user_id):
+    return f'sync:{user_id}'
+
+
+def _staged(session, key):
+    return session.info.setdefault(key, set())
+
+
+def log_products(pairs):
+    """Queue (product id, user id) pairs written outside the unit of work.
+
+    Pass the owner before as well as after a write that can move a
+    product, so the old owner's clients get a tombstone.
+    """
+    _staged(db.session, 'sync_products').update(pairs)
+
+
+def log_items(pairs):
+    """Queue (item id, product id) pairs, before and after, like log_products."""
+    _staged(db.session, 'sync_items').update(pairs)
+
+
+def _values(obj, key):
+    # The value now plus the one it replaced in this flush
+    history = inspect(obj).attrs[key].history
+    return {value for value in chain([getattr(obj, key)], history.deleted) if value is not None}
+
+
+@event.listens_for(db.session, 'after_flush')
+def _stage_flushed(session, flush_context):
+    products, items = _staged(session, 'sync_products'), _staged(session, 'sync_items')
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Product):
+            products.update((obj.id, user_id) for user_id in _values(obj, 'user_id'))
+        elif isinstance(obj, ProductItem):
+            items.update((obj.id, product_id) for product_id in _values(obj, 'product_id'))
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_log(session):
+    # Savepoints (change counter upserts) commit too; log once, at the end
+    if session.in_nested_transaction():
+        return
+    session.flush()
+    products = session.info.pop('sync_products', None)
+    items = session.info.pop('sync_items', None)
+    if products or items:
+        write_log(session, products or set(), items or set())
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_staged(session):
+    session.info.pop('sync_products', None)
+    session.info.pop('sync_items', None)
+
+
+def write_log(session, products, items):
+    """Insert change log entries for the staged rows, in the current transaction.
+
+    Items are logged with their product, whose quantity they change, and
+    a product that moved takes its items to the new owner, so those are
+    logged for every owner involved.
+    """
+    owners = defaultdict(set)
+    for product_id, user_id in products:
+        owners[product_id].add(user_id)
+    unknown = {product_id for _, product_id in items} - owners.keys()
+    if unknown:
+        owners.update(
+            (product_id, {user_id}) for product_id, user_id in session.execute(
+                select(Product.id, Product.user_id).where(Product.id.in_(unknown))
+            )
+        )
+
+    moved = [product_id for product_id, user_ids in owners.items() if len(user_ids) > 1]
+    if moved:
+        items = items | set(session.execute(
+            select(ProductItem.id, ProductItem.product_id).where(ProductItem.product_id.in_(moved))
+        ).tuples())
+
+    entries = {
+        (user_id, PRODUCT, product_id)
+        for product_id, user_ids in owners.items() for user_id in user_ids
+    }
+    entries.update(
+        (user_id, PRODUCT_ITEM, item_id)
+        for item_id, product_id in items for user_id in owners.get(product_id, ())
+    )
+    if not entries:
+        return
+
+    # Every write should have bumped its users' counters already
+    user_ids = {user_id for user_id, _, _ in entries}
+    missing = user_ids - session.info.get('changed_users', {}).keys()
+    if missing:
+        record_changes(user_ids=missing)
+    versions = session.info['changed_users']
+
+    session.execute(insert(ChangeLog), [
+        {'user_id': user_id, 'version': versions[user_id], 'entity': entity, 'entity_id': entity_id}
+        for user_id, entity, entity_id in sorted(entries)
+    ])
+
+
+def _version(scope):
+    return db.session.scalar(select(ChangeCounter.version).where(ChangeCounter.scope == scope)) or 0
+
+
+def changes_since(user_id, since=None):
+    """The user's products and items changed after ``since``, plus tombstones.
+
+    Without ``since`` every row is returned. The cursor is the user's
+    change counter, read before the rows, so a write racing this read is
+    sent again next time rather than missed. A deleted product's items
+    are gone with it and get no tombstones of their own.
+    """
+    cursor = _version(user_scope(user_id))
+    serialize_product = product_serializer.compile()
+    serialize_item = product_item_serializer.compile()
+    products = serialize_product.query(Product).filter(Product.user_id == user_id)
+    items = serialize_item.query(ProductItem).join(ProductItem.product).filter(Product.user_id == user_id)
+    changed = {PRODUCT: set(), PRODUCT_ITEM: set()}
+
+    if since is not None:
+        if since > cursor:
+            raise ValueError('Unknown cursor')
+        if since < _version(sync_scope(user_id)):
+            raise CursorExpired('Cursor has expired; sync again without since')
+
+        entries = (
+            select(ChangeLog.entity, ChangeLog.entity_id)
+            .where(ChangeLog.user_id == user_id, ChangeLog.version > since)
+            .distinct()
+        )
+        for entity, entity_id in db.session.execute(entries):
+            changed[entity].add(entity_id)
+        products = products.filter(Product.id.in_(changed[PRODUCT]))
+        items = items.filter(ProductItem.id.in_(changed[PRODUCT_ITEM]))
+
+    products = [serialize_product(product) for product in products] if since is None or changed[PRODUCT] else []
+    items = [serialize_item(item) for item in items] if since is None or changed[PRODUCT_ITEM] else []
+    return {
+        'cursor': str(cursor),
+        'full': since is None,
+        'products': products,
+        'product_items': items,
+        # Gone, or no longer this user's
+        'deleted': {
+            'products': sorted(changed[PRODUCT] - {product['id'] for product in products}),
+            'product_items': sorted(changed[PRODUCT_ITEM] - {item['id'] for item in items}),
+        },
+    }
+
+
+def compact(retention_days, now=None):
+    """Shrink the change log; returns (superseded, expired) entry counts.
+
+    Entries for a row that was logged again later are always safe to
+    drop. Entries older than ``retention_days`` are dropped too, and each
+    user's sync:<id> watermark records the newest version removed, so
+    older cursors get CursorExpired instead of silently missing changes.
+    """
+    newer = aliased(ChangeLog)
+    superseded = db.session.execute(
+        delete(ChangeLog).where(
+            select(newer.id).where(
+                newer.user_id == ChangeLog.user_id,
+                newer.entity == ChangeLog.entity,
+                newer.entity_id == ChangeLog.entity_id,
+                newer.version > ChangeLog.version,
+            ).exists()
+        ).execution_options(synchronize_session=False)
+    ).rowcount
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+    watermarks = {
+        sync_scope(user_id): version for user_id, version in db.session.execute(
+            select(ChangeLog.user_id, func.max(ChangeLog.version))
+            .where(ChangeLog.created_at < cutoff)
+            .group_by(ChangeLog.user_id)
+        )
+    }
+    if watermarks:
+        existing = set(db.session.scalars(
+            select(ChangeCounter.scope).where(ChangeCounter.scope.in_(watermarks))
+        ))
+        rows = [{'scope': scope, 'version': version} for scope, version in watermarks.items()]
+        if existing:
+            db.session.execute(update(ChangeCounter), [row for row in rows if row['scope'] in existing])
+        if len(existing) < len(rows):
+            db.session.execute(insert(ChangeCounter), [row for row in rows if row['scope'] not in existing])
+    expired = db.session.execute(
+        delete(ChangeLog).where(ChangeLog.created_at < cutoff).execution_options(synchronize_session=False)
+    ).rowcount
+
+    db.session.commit()
+    return superseded, expired
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def api(database):
+    return app.test_client()
+
+
+@pytest.fixture
+def product(api):
+    user = api.post('/users', json={'username': 'ann', 'email': 'ann@example.com', 'password': 'secret'})
+    response = api.post('/products', json={
+        'name': 'Milk', 'user_id': user.get_json()['id'], 'category': 'Dairy',
+        'storage_place': 'Fridge', 'unit': 'l'
+    })
+    return response.get_json()
+
+
+def test_get_etag_as_if_match(api, product):
+    url = f"/products/{product['id']}"
+    etag = api.get(url).headers['ETag']
+
+    response = api.patch(url, json={'name': 'Oat milk'}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Oat milk'
+
+    # The tag is stale once the row has changed
+    response = api.patch(url, json={'name': 'Soy milk'}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert response.get_json()['version'] == product['version'] + 1
+
+    etag = api.get(url).headers['ETag']
+    assert api.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert api.patch(url, json={'name': 'Soy milk'}, headers={'If-Match': etag}).status_code == 200
+
+
+def test_get_missing_row(api):
+    response = api.get('/products/1')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+
+def test_post_product_rejects_quantity(api, product):
+    response = api.post('/products', json={
+        'name': 'Eggs', 'user_id': product['user_id'], 'category': 'Dairy',
+        'storage_place': 'Fridge', 'unit': 'pcs', 'quantity': 12
+    })
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unknown fields: quantity'}
+    assert product['quantity'] == 0
+
+
+def test_sorted_page_with_fields_leaves_out_sort_key(api, product):
+    for name in ('Butter', 'Cheese'):
+        api.post('/products', json={
+            'name': name, 'user_id': product['user_id'], 'category': 'Dairy',
+            'storage_place': 'Fridge', 'unit': 'g'
+        })
+
+    response = api.get('/products?sort=name&fields=category&limit=2')
+    assert response.status_code == 200
+    assert response.get_json() == [{'id': 2, 'category': 'Dairy'}, {'id': 3, 'category': 'Dairy'}]
+
+    response = api.get(f"/products?sort=name&fields=category&limit=2&after={response.headers['X-Next-Cursor']}")
+    assert response.get_json() == [{'id': 1, 'category': 'Dairy'}]
+
+
+def test_expiring_pages_and_etag(api, product):
+    today = date.today()
+    api.post('/product_items/bulk', json=[
+        {'product_id': product['id'], 'brand_name': brand, 'quantity': 1,
+         'expiry_date': (today + timedelta(days=days)).isoformat()}
+        for brand, days in (('A', 3), ('B', -1), ('C', 0), ('D', 20))
+    ])
+    url = f"/product_items/expiring?user_id={product['user_id']}&within=1m&include=&fields=brand_name&limit=2"
+
+    first = api.get(url)
+    assert first.status_code == 200
+    body = first.get_json()
+    assert body['counts'] == {'expired': 1, 'today': 1, 'this_week': 1, 'this_month': 1, 'later': 0}
+    assert body['buckets']['expired'] == [{'id': 2, 'brand_name': 'B'}]
+    assert body['buckets']['today'] == [{'id': 3, 'brand_name': 'C'}]
+    assert api.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    second = api.get(f"{url}&after={first.headers['X-Next-Cursor']}").get_json()
+    assert second['counts'] == body['counts']
+    assert [item['brand_name'] for bucket in second['buckets'].values() for item in bucket] == ['A', 'D']
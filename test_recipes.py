@@ -0,0 +1,124 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import app
+from cache import LRUCache
+from recipes import RecipeService, StubCompletionClient, normalize_ingredients
+
+
+@pytest.fixture
+def client():
+    return StubCompletionClient()
+
+
+@pytest.fixture
+def service(client):
+    return RecipeService(client=client, cache=LRUCache(maxsize=16, ttl=60))
+
+
+def parse_sse(body):
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        if block:
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@pytest.fixture
+def api(monkeypatch, service):
+    monkeypatch.setattr('app.recipe_service', service)
+    return app.test_client()
+
+
+def test_normalize_ingredients():
+    assert normalize_ingredients('Eggs, milk ,eggs') == ['eggs', 'milk']
+    assert normalize_ingredients(['milk', ' Eggs', '']) == ['eggs', 'milk']
+    for bad in (5, None, {'eggs': 1}, ['eggs', 2]):
+        with pytest.raises(ValueError):
+            normalize_ingredients(bad)
+
+
+def test_cache_hit(service, client):
+    first = service.get_recipes(['eggs', 'milk'])
+    assert service.get_recipes(['eggs', 'milk']) == first
+    assert client.calls == 1
+    assert service.cache.stats()['hits'] == 1
+
+
+def test_order_insensitive_key(service, client):
+    service.get_recipes(normalize_ingredients('milk, Eggs'))
+    service.get_recipes(normalize_ingredients(['eggs', 'MILK', 'eggs']))
+    assert client.calls == 1
+
+
+def test_concurrent_identical_calls_coalesce(client):
+    # Hold the upstream call open until every caller is waiting on it
+    release = threading.Event()
+    complete = client.complete
+
+    def slow_complete(prompt):
+        release.wait(5)
+        return complete(prompt)
+
+    client.complete = slow_complete
+    service = RecipeService(client=client, cache=LRUCache(maxsize=16, ttl=60))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(service.get_recipes, ['eggs', 'milk']) for _ in range(8)]
+        while service.coalesced < 7:
+            threading.Event().wait(0.01)
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    assert client.calls == 1
+    assert service.upstream_calls == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_post_recipes(api, client):
+    response = api.post('/recipes', json={'ingredients': 'milk, eggs'})
+    assert response.status_code == 200
+    assert response.get_json() == client.text_for('eggs, milk').split('\n')
+
+
+@pytest.mark.parametrize('ingredients', [5, {'eggs': 1}, ['eggs', 2]])
+def test_post_recipes_rejects_bad_ingredients(api, client, ingredients):
+    response = api.post('/recipes', json={'ingredients': ingredients})
+    assert response.status_code == 400
+    assert 'ingredients must be' in response.get_json()['error']
+    assert client.calls == 0
+
+
+def test_post_recipes_requires_ingredients(api):
+    assert api.post('/recipes', json={'ingredients': ' , '}).status_code == 400
+    assert api.post('/recipes', json=['eggs']).status_code == 400
+
+
+def test_stream_recipes(api, client):
+    response = api.post('/recipes', json={'ingredients': 'milk, eggs'}, headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    events = parse_sse(response.data)
+    tokens = [data for event, data in events if event == 'token']
+    assert tokens == client.tokens_for('eggs, milk')
+    assert events[-1] == ('recipes', client.text_for('eggs, milk').split('\n'))
+
+    # The JSON response, now from the cache the stream filled, is the same array
+    assert api.post('/recipes', json={'ingredients': 'eggs,milk'}).get_json() == events[-1][1]
+    assert client.calls == 1
+
+
+def test_stream_recipes_upstream_failure(api, client):
+    def failing_stream(prompt):
+        yield 'Quick '
+        raise RuntimeError('upstream went away')
+
+    client.stream = failing_stream
+    response = api.post('/recipes', json={'ingredients': 'eggs'}, headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 200
+    assert parse_sse(response.data) == [('token', 'Quick '), ('error', {'error': 'upstream went away'})]
@@ -0,0 +1,98 @@
+from flask import request, jsonify, make_response
+from sqlalchemy import select, update
+
+from bulk import BulkSchema
+from models import db
+
+
+class PatchSchema:
+    """Whitelisted, validated columns for a single-row PATCH.
+
+    Column types and lengths are checked like the bulk endpoints, then
+    the model's @validates hooks run, since the UPDATE bypasses them.
+    Fields that are not columns (a password) are passed through as is.
+    ``id`` and ``version`` may be echoed back in the body.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.schema = BulkSchema(model, required=())
+
+    def clean(self, data):
+        if not isinstance(data, dict):
+            raise ValueError('Expected an object')
+
+        unknown = set(data) - set(self.fields) - {'id', 'version'}
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        values = {}
+        for key in self.fields:
+            if key not in data:
+                continue
+            value = data[key]
+            if key in self.schema.columns:
+                value = self.schema.clean_value(key, value)
+            validator = self.model.__mapper__.validators.get(key)
+            if validator is not None:
+                # The validators do not use the instance
+                value = validator[0](None, key, value)
+            values[key] = value
+        return values
+
+
+def expected_version(data):
+    """The version a PATCH expects, and the status to answer a mismatch with.
+
+    ``If-Match`` with the ETag of a GET of the row, or just its quoted
+    version (``"3"``), gets 412 Precondition Failed, a ``version`` in the
+    body 409 Conflict. Without either the update is unconditional.
+    """
+    if request.if_match:
+        if request.if_match.star_tag:
+            return None, None
+        tags = request.if_match.as_set(include_weak=True)
+        version = next(iter(tags)).split('.', 1)[0] if len(tags) == 1 else ''
+        if not version.isdigit():
+            raise ValueError('If-Match must be the ETag of the row or its quoted version, e.g. "3"')
+        return int(version), 412
+
+    version = data.get('version') if isinstance(data, dict) else None
+    if version is None:
+        return None, None
+    if isinstance(version, bool) or not isinstance(version, int):
+        raise ValueError('version must be an integer')
+    return version, 409
+
+
+def versioned_update(model, id, values, expected=None):
+    """Compare-and-swap UPDATE of one row, bumping its version.
+
+    One UPDATE ... RETURNING statement where the database supports it.
+    Returns the updated object, or None when the row is missing or its
+    version is not ``expected``.
+    """
+    statement = update(model).where(model.id == id).values(version=model.version + 1, **values)
+    if expected is not None:
+        statement = statement.where(model.version == expected)
+
+    if db.engine.dialect.update_returning:
+        return db.session.scalars(statement.returning(model)).one_or_none()
+    if not db.session.execute(statement).rowcount:
+        return None
+    return db.session.get(model, id, populate_existing=True)
+
+
+def row_version(model, id):
+    """The row's current version, or None when it does not exist."""
+    return db.session.scalar(select(model.version).where(model.id == id))
+
+
+def failed_update(model, id, status):
+    """404, or the mismatch status with the row's current version."""
+    current = row_version(model, id)
+    db.session.rollback()
+    if current is None:
+        return make_response(jsonify({'error': f'{model.__name__} not found'}), 404)
+    return make_response(jsonify({'error': 'Version mismatch', 'version': current}), status)